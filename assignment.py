@@ -0,0 +1,83 @@
+import numpy as np
+
+
+def manhattan_cost(sources, targets):
+    """Manhattan distance between every source (rows) and target (columns), both (n, 2) arrays."""
+    sources = np.asarray(sources).reshape(-1, 2)
+    targets = np.asarray(targets).reshape(-1, 2)
+    return np.abs(sources[:, None, :] - targets[None, :, :]).sum(axis=2)
+
+
+def greedy_assignment(cost):
+    """
+    Rows take their cheapest free column one after another, in row order.
+    Returns the column for every row, -1 when none is left.
+    """
+    cost = np.asarray(cost, dtype=float)
+    n, m = cost.shape
+    taken = np.zeros(m, dtype=bool)
+    result = np.full(n, -1)
+    for i in range(min(n, m)):
+        row = np.where(taken, np.inf, cost[i])
+        j = int(np.argmin(row))
+        result[i] = j
+        taken[j] = True
+    return result
+
+
+def optimal_assignment(cost):
+    """
+    Hungarian method (shortest augmenting paths with potentials), minimising
+    the total cost. The inner loop over columns is vectorized.
+    Returns the column for every row, -1 when there are more rows than columns.
+    """
+    cost = np.asarray(cost, dtype=float)
+    n, m = cost.shape
+    if n > m:
+        columns = optimal_assignment(cost.T)
+        result = np.full(n, -1)
+        result[columns] = np.arange(m)
+        return result
+
+    # 1-based as in the textbook version; column 0 is a virtual start
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=int)  # row assigned to each column, 0 = none
+    way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            improve = free[1:] & (reduced < minv[1:])
+            minv[1:][improve] = reduced[improve]
+            way[1:][improve] = j0
+            candidates = np.where(free[1:], minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    result = np.full(n, -1)
+    assigned = np.nonzero(p[1:])[0]
+    result[p[1:][assigned] - 1] = assigned
+    return result
+
+
+SOLVERS = {
+    'greedy': greedy_assignment,
+    'optimal': optimal_assignment,
+}
@@ -0,0 +1,447 @@
+import contextlib
+import datetime
+import gc
+import io
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from assignment import SOLVERS, manhattan_cost
+from replay import ReplayLink
+from route_planner import DistanceTable, Job, plan_route
+from spatial_index import SpatialIndex, manhattan
+from simulation.protocol import CODECS, FrameDecoder, decode_messages, encode_message
+from supervisor import Supervisor
+
+
+# bench_framing fails, and the run exits nonzero, below this many events per second
+MIN_FRAMING_RATE = 10000
+
+
+def make_events(count):
+    return [
+        {
+            "id": "new_order",
+            "order_number": i,
+            "food": {"size": 1 + i % 3},
+            "address": [1 + i % 20, 2 + i % 19],
+            "restaurant": [4, 5],
+        }
+        for i in range(count)
+    ]
+
+
+def make_event_mix(count):
+    """A mix resembling one simulation run: orders, robot and food events."""
+    templates = [
+        lambda i: {"id": "new_order", "order_number": i, "food": {"size": 1 + i % 3},
+                   "address": [1 + i % 20, 2 + i % 19], "restaurant": [4, 5]},
+        lambda i: {"id": "food_start", "order_number": i, "food": {"size": 2}, "restaurant": [4, 5]},
+        lambda i: {"id": "robot_pick", "robot_number": i % 200, "order_number": i,
+                   "food": {"size": 2}, "restaurant": [4, 5]},
+        lambda i: {"id": "robot_arrived", "robot_number": i % 200, "restaurant": [4, 5]},
+        lambda i: {"id": "food_ready", "order_number": i, "restaurant": [4, 5], "food": {"size": 1}},
+        lambda i: {"id": "food_picked", "order_number": i, "food": {"size": 1}, "restaurant": [4, 5]},
+        lambda i: {"id": "robot_deliver", "robot_number": i % 200, "food": {"size": 1},
+                   "address": [7, 8], "order_number": i},
+        lambda i: {"id": "food_delivered", "order_number": i, "address": [7, 8]},
+        lambda i: {"id": "robot_empty", "robot_number": i % 200},
+        lambda i: {"id": "battery_low", "robot_number": i % 200},
+    ]
+    return [templates[i % len(templates)](i) for i in range(count)]
+
+
+def time_codec(codec, events, batches):
+    # Like timeit, keep the collector from charging one codec for the other's garbage
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        payloads = [codec.encode(batch) for batch in batches]
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = [event for payload in payloads for event in codec.decode(payload)]
+        decode_time = time.perf_counter() - start
+    finally:
+        gc.enable()
+
+    assert decoded == events, f"{codec.name} codec does not round-trip"
+    return sum(len(payload) for payload in payloads), encode_time, decode_time
+
+
+def bench_codec(total_events=100000, batch_size=50):
+    """Bytes per event and encode/decode time of every wire format."""
+    events = make_event_mix(total_events)
+    batches = [events[i:i + batch_size] for i in range(0, total_events, batch_size)]
+    results = {}
+    for name, codec in CODECS.items():
+        size, encode_time, decode_time = time_codec(codec, events, batches)
+        results[name] = (size / total_events, encode_time, decode_time)
+        print(f"codec {name:6}: {size / total_events:6.1f} bytes/event | "
+              f"encode {1e6 * encode_time / total_events:5.2f} us/event | "
+              f"decode {1e6 * decode_time / total_events:5.2f} us/event")
+    return results
+
+
+def bench_framing(total_events=200000, batch_size=50):
+    """
+    Push batches of events with the framed protocol through a connected
+    socket.socketpair() (a Unix domain stream socket, not TCP) and measure
+    how many events per second come out decoded on the other side. Fails
+    below MIN_FRAMING_RATE.
+    """
+    batches = [make_events(batch_size) for _ in range(total_events // batch_size)]
+    sender, receiver = socket.socketpair()
+    receiver.settimeout(5)
+
+    def produce():
+        for batch in batches:
+            sender.sendall(encode_message(batch))
+        sender.shutdown(socket.SHUT_WR)
+
+    decoder = FrameDecoder()
+    received = 0
+    start = time.perf_counter()
+    producer = threading.Thread(target=produce)
+    producer.start()
+    while True:
+        data = receiver.recv(65536)
+        if not data:
+            break
+        received += len(decode_messages(decoder.feed(data)))
+    elapsed = time.perf_counter() - start
+    producer.join()
+    sender.close()
+    receiver.close()
+
+    assert received == len(batches) * batch_size, f"Lost events: {received}"
+    assert decoder.pending() == 0, "Partial frame left in buffer"
+    rate = received / elapsed
+    print(f"framing: {received} events in {elapsed:.3f} s -> {rate:,.0f} events/s")
+    assert rate >= MIN_FRAMING_RATE, f"framing: {rate:,.0f} events/s is below {MIN_FRAMING_RATE:,}"
+    return rate
+
+
+def make_supervisor(max_robots):
+    config = {"max_robots": max_robots, "city_size": [22, 22]}
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Supervisor(None, None, communication=ReplayLink(), config=config)
+
+
+def bench_routing(open_orders=(10, 100, 1000, 5000), total_events=20000, max_robots=50):
+    """
+    Events/second through Supervisor.receive against the number of open
+    orders. The stream is made of events addressed to one order or robot,
+    which is what most of the traffic looks like.
+    """
+    rng = random.Random(0)
+    results = {}
+    for count in open_orders:
+        supervisor = make_supervisor(max_robots)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for order_number in range(count):
+                supervisor.receive({"id": "new_order", "order_number": order_number, "food": {"size": 1},
+                                    "restaurant": [rng.randrange(22), rng.randrange(22)], "address": [4, 5]})
+            supervisor.to_send = []
+
+        robot_ids = [robot.id for robot in supervisor.robots]
+        events = []
+        for i in range(total_events):
+            match i % 3:
+                case 0:
+                    events.append({"id": "food_start", "order_number": rng.randrange(count),
+                                   "food": {"size": 1}, "restaurant": [1, 2]})
+                case 1:
+                    events.append({"id": "battery_low", "robot_number": rng.choice(robot_ids)})
+                case 2:
+                    events.append({"id": "robot_returned", "robot_number": rng.choice(robot_ids)})
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for event in events:
+                supervisor.receive(event)
+            elapsed = time.perf_counter() - start
+        results[count] = total_events / elapsed
+        print(f"routing: {count:5} open orders -> {total_events / elapsed:10,.0f} events/s")
+    return results
+
+
+class PointRobot:
+    def __init__(self, id, position):
+        self.id = id
+        self.position = position
+
+
+def bench_nearest(fleet_sizes=(100, 1000, 10000), queries=2000, city=(66, 66), k=3):
+    """
+    k-nearest-robot queries through SpatialIndex against a linear scan over
+    the fleet, checking both return the same robots.
+    """
+    rng = random.Random(0)
+    results = {}
+    for size in fleet_sizes:
+        robots = [PointRobot(i, [rng.randrange(city[0]), rng.randrange(city[1])]) for i in range(size)]
+        index = SpatialIndex(cell_size=3)
+        for robot in robots:
+            index.add(robot)
+        points = [[rng.randrange(city[0]), rng.randrange(city[1])] for _ in range(queries)]
+
+        start = time.perf_counter()
+        found = [index.nearest(point, k) for point in points]
+        index_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        expected = [sorted(robots, key=lambda robot: (manhattan(robot.position, point), robot.id))[:k]
+                    for point in points]
+        scan_time = time.perf_counter() - start
+
+        assert found == expected, "SpatialIndex disagrees with a linear scan"
+        results[size] = (queries / index_time, queries / scan_time)
+        print(f"nearest: {size:6} robots -> index {queries / index_time:10,.0f} queries/s | "
+              f"scan {queries / scan_time:10,.0f} queries/s")
+    return results
+
+
+def assign_per_order(orders, robots):
+    """The old way: every order on its own takes the nearest robot still free."""
+    free = list(robots)
+    total = 0
+    for order in orders:
+        best = min(free, key=lambda robot: abs(robot[0] - order[0]) + abs(robot[1] - order[1]))
+        total += abs(best[0] - order[0]) + abs(best[1] - order[1])
+        free.remove(best)
+    return total
+
+
+def bench_assignment(cases=((20, 25), (100, 120), (300, 400), (100, 2000)), city=(22, 22), repeats=3):
+    """
+    Time and total robot-to-restaurant distance of a batch of new orders,
+    assigned one by one against the batch solvers on a NumPy cost matrix.
+    """
+    rng = random.Random(0)
+    results = {}
+    for order_count, robot_count in cases:
+        orders = [(rng.randrange(city[0]), rng.randrange(city[1])) for _ in range(order_count)]
+        robots = [(rng.randrange(city[0]), rng.randrange(city[1])) for _ in range(robot_count)]
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            loop_total = assign_per_order(orders, robots)
+        line = [f"loop {1000 * (time.perf_counter() - start) / repeats:7.2f} ms, distance {loop_total:5}"]
+
+        for name, solver in SOLVERS.items():
+            start = time.perf_counter()
+            for _ in range(repeats):
+                cost = manhattan_cost(orders, robots)
+                columns = solver(cost)
+            elapsed = 1000 * (time.perf_counter() - start) / repeats
+            total = int(cost[np.arange(order_count), columns].sum())
+            line.append(f"{name} {elapsed:7.2f} ms, distance {total:5}")
+            results[(order_count, robot_count, name)] = (elapsed, total)
+        print(f"assignment: {order_count:4} orders x {robot_count:5} robots -> " + " | ".join(line))
+    return results
+
+
+def nearest_first_length(start, jobs):
+    """The old way: collect restaurants nearest first, then deliver nearest first."""
+    total = 0
+    point = start
+    for stops in ({tuple(job.pickup) for job in jobs}, [job.delivery for job in jobs]):
+        left = list(stops)
+        while left:
+            nearest = min(left, key=lambda stop: manhattan(stop, point))
+            total += manhattan(nearest, point)
+            point = nearest
+            left.remove(nearest)
+    return total
+
+
+def bench_route(trip_sizes=(2, 3, 5, 8), trips=300, city=(22, 22), capacity=5):
+    """
+    Length of the routes plan_route finds for trips of several one-size
+    orders from nearby restaurants against nearest-first visiting, and the
+    time it takes to plan one.
+    """
+    rng = random.Random(0)
+    restaurants = [(rng.randrange(city[0]), rng.randrange(city[1])) for _ in range(3)]
+    results = {}
+    for size in trip_sizes:
+        problems = []
+        for _ in range(trips):
+            start = (rng.randrange(city[0]), rng.randrange(city[1]))
+            jobs = [Job(i, rng.choice(restaurants), (rng.randrange(city[0]), rng.randrange(city[1])), 1)
+                    for i in range(size)]
+            problems.append((start, jobs))
+
+        distances = DistanceTable()
+        start_time = time.perf_counter()
+        routes = [plan_route(start, jobs, distances, max(capacity, size)) for start, jobs in problems]
+        elapsed = time.perf_counter() - start_time
+
+        planned = 0
+        for (start, _), route in zip(problems, routes):
+            point = start
+            for stop in route:
+                planned += manhattan(point, stop.point)
+                point = stop.point
+        nearest_first = sum(nearest_first_length(start, jobs) for start, jobs in problems)
+        results[size] = (1000 * elapsed / trips, planned, nearest_first)
+        print(f"route: {size} orders per trip -> {1000 * elapsed / trips:6.2f} ms/plan | "
+              f"length {planned / trips:6.1f} | nearest first {nearest_first / trips:6.1f}")
+    return results
+
+
+# Fixed-seed end-to-end runs: overrides of simulation/config.json
+SCENARIOS = {
+    "small": {"max_robots": 20, "city_size": [22, 22], "restaurant_count": 3, "backpack_capacity": 3},
+    "default": {"max_robots": 200, "city_size": [22, 22], "restaurant_count": 5, "backpack_capacity": 5},
+    "city": {"max_robots": 200, "city_size": [46, 46], "restaurant_count": 10, "backpack_capacity": 5},
+    "fleet": {"max_robots": 1000, "city_size": [46, 46], "restaurant_count": 20, "backpack_capacity": 8},
+}
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        return probe.getsockname()[1]
+
+
+def search(pattern, text):
+    """Numbers in the groups of the last match of pattern in text."""
+    matches = re.findall(pattern, text)
+    if not matches:
+        raise RuntimeError(f"'{pattern}' not found in the output")
+    last = matches[-1] if isinstance(matches[-1], tuple) else (matches[-1],)
+    return [float(value) for value in last]
+
+
+def run_scenario(overrides, ticks, seed, timeout=300):
+    """
+    One headless simulation against a supervisor, both as separate
+    processes on a copy of simulation/config.json with overrides applied.
+    Returns the figures both print when they finish.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(root, "simulation", "config.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    config.update(overrides, seed=seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, "config.json")
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        port = str(free_port())
+        with open(os.path.join(directory, "simulation.log"), "w+") as simulation_log, \
+                open(os.path.join(directory, "supervisor.log"), "w+") as supervisor_log:
+            simulation = subprocess.Popen(
+                [sys.executable, "main.py", port, "--headless", "--ticks", str(ticks), "--config", config_path],
+                cwd=os.path.join(root, "simulation"), stdout=simulation_log, stderr=subprocess.STDOUT)
+            # The supervisor retries every 3 s while nothing listens, so give the simulation a head start
+            time.sleep(1)
+            supervisor = subprocess.Popen([sys.executable, "supervisor.py", port, config_path],
+                                          cwd=root, stdout=supervisor_log, stderr=subprocess.STDOUT)
+            try:
+                simulation.wait(timeout)
+                supervisor.wait(timeout)
+            finally:
+                simulation.kill()
+                supervisor.kill()
+            simulation_log.seek(0)
+            supervisor_log.seek(0)
+            simulation_output = simulation_log.read()
+            supervisor_output = supervisor_log.read()
+
+    ticks_per_second, = search(r"Ticks: \d+ in [\d.]+ s \| ([\d.]+) ticks/s", simulation_output)
+    events_per_second, = search(r"Events handled: \d+ in [\d.]+ s \| (\d+) events/s", simulation_output)
+    generated, realized = search(r"Total orders: +(\d+) \| Realized orders: +(\d+)", simulation_output)
+    received, = search(r"handled \d+ events in [\d.]+ s \| (\d+) events/s", supervisor_output)
+    p50, p95, p99 = search(r"latency \[ms\] p50 ([\d.]+) \| p95 ([\d.]+) \| p99 ([\d.]+)", supervisor_output)
+    return {
+        "ticks/s": ticks_per_second,
+        "process_events events/s": events_per_second,
+        "receive events/s": received,
+        "latency p50": p50,
+        "latency p95": p95,
+        "latency p99": p99,
+        "orders": (int(generated), int(realized)),
+    }
+
+
+def bench_scenarios(scenarios=tuple(SCENARIOS), ticks=2000, seed=42):
+    """
+    Simulation ticks/second, events/second through EventQueue.process_events,
+    supervisor events/second and decision latency for every scenario.
+    """
+    results = {}
+    for name in scenarios:
+        overrides = SCENARIOS[name]
+        result = run_scenario(overrides, ticks, seed)
+        results[name] = result
+        width, height = overrides["city_size"]
+        print(f"scenario {name:7}: {overrides['max_robots']:4} robots, {width}x{height}, "
+              f"{overrides['restaurant_count']:2} restaurants, backpack {overrides['backpack_capacity']} -> "
+              f"sim {result['ticks/s']:7.1f} ticks/s | "
+              f"process_events {result['process_events events/s']:9,.0f} events/s | "
+              f"supervisor {result['receive events/s']:7,.0f} events/s | "
+              f"latency p50 {result['latency p50']:6.3f} p95 {result['latency p95']:6.3f} "
+              f"p99 {result['latency p99']:6.3f} ms | "
+              f"realized {result['orders'][1]}/{result['orders'][0]}")
+    return results
+
+
+BENCHMARKS = {
+    "framing": bench_framing,
+    "codec": bench_codec,
+    "routing": bench_routing,
+    "nearest": bench_nearest,
+    "assignment": bench_assignment,
+    "route": bench_route,
+    "scenarios": bench_scenarios,
+}
+
+OUTPUT = "bench_output.txt"
+
+
+class Tee(io.TextIOBase):
+    """Writes to several streams at once."""
+
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, text):
+        for stream in self.streams:
+            stream.write(text)
+        return len(text)
+
+    def flush(self):
+        for stream in self.streams:
+            stream.flush()
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    # Every run is appended to OUTPUT under a header, so runs of different revisions can be compared
+    with open(OUTPUT, "a", encoding="utf-8") as output, contextlib.redirect_stdout(Tee(sys.stdout, output)):
+        print(f"# {datetime.datetime.now().isoformat(timespec='seconds')} | revision {git_revision()} | "
+              f"python {sys.version.split()[0]} | {' '.join(names)}")
+        for name in names:
+            BENCHMARKS[name]()
+        print()
@@ -3,4 +3,4 @@
 
 
 cd simulation
-python3 main.py 
+python3 main.py "$@"
@@ -0,0 +1,62 @@
+import sys
+import time
+
+import numpy as np
+
+from simulation.recorder import FROM_SUPERVISOR, TO_SUPERVISOR, load_recording
+from supervisor import Supervisor
+
+
+class ReplayLink:
+    """Stands in for the supervisor's Communication and keeps what it sends."""
+    def __init__(self):
+        self.sent = []
+
+    def send_dict(self, data_):
+        self.sent.append(data_)
+
+    def close(self):
+        pass
+
+
+def replay(path):
+    """
+    Feed a recording made with `main.py --record` to the supervisor, tick by
+    tick and without the simulation, and compare its decisions with the
+    recorded ones. Robots are addressed by number in the recorded events, so
+    once a dispatch change picks a different robot the two runs diverge;
+    the traffic fed in stays identical.
+    """
+    config, ticks = load_recording(path)
+    link = ReplayLink()
+    supervisor = Supervisor(None, None, communication=link, config=config)
+
+    last_tick = max(ticks, default=0)
+    latencies = []
+    events = 0
+    mismatched_ticks = 0
+    start = time.perf_counter()
+    for tick, exchanged in ticks.items():
+        tick_start = time.perf_counter()
+        supervisor.receive_batch(exchanged[TO_SUPERVISOR])
+        supervisor.flush(acknowledge=True)
+        latencies.append(time.perf_counter() - tick_start)
+        events += len(exchanged[TO_SUPERVISOR])
+
+        # Decisions for tick N reach the simulation at tick N + 1
+        if tick == last_tick:
+            continue
+        recorded = ticks.get(tick + 1, {FROM_SUPERVISOR: []})[FROM_SUPERVISOR]
+        if link.sent[-1] != recorded:
+            mismatched_ticks += 1
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000.0
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(f'replayed {len(ticks)} ticks, {events} events in {elapsed:.3f} s -> {events / elapsed:,.0f} events/s')
+    print(f'decision latency per tick [ms]: mean {latencies.mean():.3f} | p50 {p50:.3f} | p99 {p99:.3f}')
+    print(f'ticks with decisions different from the recording: {mismatched_ticks}')
+
+
+if __name__ == "__main__":
+    replay(sys.argv[1])
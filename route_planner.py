@@ -0,0 +1,206 @@
+from typing import NamedTuple
+
+from spatial_index import manhattan
+
+# Routes up to this many stops are planned exactly, longer ones by insertion
+EXACT_STOPS = 8
+
+
+class DistanceTable:
+    """
+    Distances between points, each pair computed once. Robots keep going
+    between the same few restaurants and addresses, so replanning a route
+    mostly reads the table.
+    """
+
+    def __init__(self, metric=manhattan):
+        self.metric = metric
+        self.table = {}
+
+    def __call__(self, a, b):
+        key = (a[0], a[1], b[0], b[1])
+        if key not in self.table:
+            self.table[key] = self.metric(a, b)
+        return self.table[key]
+
+    def __len__(self):
+        return len(self.table)
+
+
+class Job(NamedTuple):
+    """One order in a route: picked up at pickup (None when already carried), dropped at delivery."""
+    key: object
+    pickup: tuple
+    delivery: tuple
+    size: int
+
+
+class Stop(NamedTuple):
+    kind: str  # 'pickup' or 'deliver'
+    point: tuple
+    jobs: tuple  # keys of the jobs picked up or delivered here
+
+
+def make_stops(jobs):
+    """One pickup stop per distinct restaurant, one delivery stop per job."""
+    pickups = {}
+    for job in jobs:
+        if job.pickup is not None:
+            pickups.setdefault(tuple(job.pickup), []).append(job)
+    stops = [Stop('pickup', point, tuple(job.key for job in group)) for point, group in pickups.items()]
+    stops += [Stop('deliver', tuple(job.delivery), (job.key,)) for job in jobs]
+    return stops
+
+
+class Problem:
+    """Stops with their precedence and load changes, shared by both planners."""
+
+    def __init__(self, jobs, distance, capacity, load):
+        self.stops = make_stops(jobs)
+        self.distance = distance
+        self.capacity = capacity
+        self.load = load
+        size = {job.key: job.size for job in jobs}
+        pickup_of = {key: i for i, stop in enumerate(self.stops) if stop.kind == 'pickup' for key in stop.jobs}
+        # Bit mask of stops that have to come before each stop
+        self.before = [1 << pickup_of[stop.jobs[0]] if stop.kind == 'deliver' and stop.jobs[0] in pickup_of else 0
+                       for stop in self.stops]
+        self.change = [sum(size[key] for key in stop.jobs) * (1 if stop.kind == 'pickup' else -1)
+                       for stop in self.stops]
+
+    def feasible(self, order, check_capacity=True):
+        """Whether visiting stops in this order keeps precedence and capacity."""
+        visited = 0
+        load = self.load
+        for i in order:
+            if self.before[i] & ~visited:
+                return False
+            load += self.change[i]
+            if check_capacity and self.capacity is not None and load > self.capacity:
+                return False
+            visited |= 1 << i
+        return True
+
+    def safe_order(self):
+        """Carried orders first, then each pickup followed by its deliveries."""
+        delivery_of = {stop.jobs[0]: i for i, stop in enumerate(self.stops) if stop.kind == 'deliver'}
+        order = [i for i, before in enumerate(self.before) if self.stops[i].kind == 'deliver' and not before]
+        for i, stop in enumerate(self.stops):
+            if stop.kind == 'pickup':
+                order += [i] + [delivery_of[key] for key in stop.jobs]
+        return order
+
+    def length(self, start, order):
+        total = 0
+        point = start
+        for i in order:
+            total += self.distance(point, self.stops[i].point)
+            point = self.stops[i].point
+        return total
+
+
+def plan_exact(problem, start):
+    """Held-Karp over subsets of stops, with infeasible steps left out."""
+    stops = problem.stops
+    n = len(stops)
+    # best[(mask, last)] = (length, previous last)
+    best = {}
+    for i in range(n):
+        if not problem.before[i] and problem.feasible([i]):
+            best[(1 << i, i)] = (problem.distance(start, stops[i].point), None)
+    load_of = {}
+    for mask in range(1, 1 << n):
+        if mask not in load_of:
+            load_of[mask] = problem.load + sum(problem.change[i] for i in range(n) if mask >> i & 1)
+        for last in range(n):
+            entry = best.get((mask, last))
+            if entry is None:
+                continue
+            for i in range(n):
+                if mask >> i & 1 or problem.before[i] & ~mask:
+                    continue
+                load = load_of[mask] + problem.change[i]
+                if problem.capacity is not None and load > problem.capacity:
+                    continue
+                length = entry[0] + problem.distance(stops[last].point, stops[i].point)
+                key = (mask | 1 << i, i)
+                if key not in best or length < best[key][0]:
+                    best[key] = (length, last)
+
+    full = (1 << n) - 1
+    ends = [(best[(full, last)][0], last) for last in range(n) if (full, last) in best]
+    if not ends:
+        return None
+    _, last = min(ends)
+    order = []
+    mask = full
+    while last is not None:
+        order.append(last)
+        _, previous = best[(mask, last)]
+        mask &= ~(1 << last)
+        last = previous
+    return order[::-1]
+
+
+def plan_insertion(problem, start):
+    """
+    Cheapest insertion of every stop, pickups before deliveries, then moving
+    single stops while it shortens the route. Capacity is only checked on
+    the finished route; when that breaks it, the search starts over from
+    Problem.safe_order instead.
+    """
+    order = []
+    for i in sorted(range(len(problem.stops)), key=lambda i: problem.stops[i].kind != 'pickup'):
+        candidates = [order[:position] + [i] + order[position:] for position in range(len(order) + 1)]
+        order = min((candidate for candidate in candidates if problem.feasible(candidate, check_capacity=False)),
+                    key=lambda candidate: problem.length(start, candidate))
+    if not problem.feasible(order):
+        order = problem.safe_order()
+        if not problem.feasible(order):
+            return None
+
+    improved = True
+    while improved:
+        improved = False
+        length = problem.length(start, order)
+        for i in range(len(order)):
+            rest = order[:i] + order[i + 1:]
+            for position in range(len(order)):
+                if position == i:
+                    continue
+                candidate = rest[:position] + [order[i]] + rest[position:]
+                if problem.feasible(candidate) and problem.length(start, candidate) < length:
+                    order = candidate
+                    improved = True
+                    break
+            if improved:
+                break
+    return order
+
+
+def plan_route(start, jobs, distance=manhattan, capacity=None, load=0):
+    """
+    Shortest order of stops starting at start that picks up every job before
+    delivering it and never carries more than capacity (load is what the
+    robot carries already). Returns a list of Stop, None if no order fits.
+    """
+    problem = Problem(jobs, distance, capacity, load)
+    if not problem.stops:
+        return []
+    if len(problem.stops) <= EXACT_STOPS:
+        order = plan_exact(problem, tuple(start))
+    else:
+        order = plan_insertion(problem, tuple(start))
+    if order is None:
+        return None
+    return [problem.stops[i] for i in order]
+
+
+def route_length(start, route, distance=manhattan):
+    """Length of a route returned by plan_route, starting at start."""
+    total = 0
+    point = tuple(start)
+    for stop in route:
+        total += distance(point, stop.point)
+        point = stop.point
+    return total
@@ -0,0 +1,65 @@
+import random
+
+
+def generate_buildings(city_size, num_restaurants, road_spacing=3, rng=random):
+    """
+    Generate buildings, restaurants, and main roads in the city.
+    """
+    buildings = {}
+    available_positions = [
+        (x, y)
+        for x in range(city_size[0])
+        for y in range(city_size[1])
+    ]
+
+    # Base
+    base_position = (0, 0)
+    buildings = {base_position: "robot_base"}
+    available_positions.remove(base_position)
+
+    # Roads
+    road_positions = [
+        (x, y)
+        for x in range(city_size[0])
+        for y in range(city_size[1])
+        if x % road_spacing == 0 or y % road_spacing == 0
+    ]
+    for x, y in road_positions:
+        if (x, y) != base_position:
+            buildings[(x, y)] = "road"
+
+
+    # Restaurants, only where a robot can get to: next to a road
+    def next_to_road(x, y):
+        return any(
+            0 <= nx < city_size[0] and 0 <= ny < city_size[1]
+            and (nx % road_spacing == 0 or ny % road_spacing == 0)
+            for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1))
+        )
+
+    candidates = [pos for pos in available_positions if pos not in road_positions and next_to_road(*pos)]
+    if len(candidates) < num_restaurants:
+        raise ValueError(f"Only {len(candidates)} cells next to a road for {num_restaurants} restaurants")
+    restaurant_positions = rng.sample(candidates, num_restaurants)
+    for x, y in restaurant_positions:
+        buildings[(x, y)] = "restaurant"
+
+
+    # Rest of the buildings
+    for x, y in available_positions:
+        if (x, y) not in buildings:
+            buildings[(x, y)] = rng.choice(
+                ["house", "block", "skyscraper", "shop"]
+            )
+    return buildings
+
+
+def get_restaurants(buildings):
+    """
+    Returns a list of coordinates where restaurants are located.
+    """
+    restaurants_list = []
+    for position, building_type in buildings.items():
+        if building_type == "restaurant":
+            restaurants_list.append(position)
+    return restaurants_list
@@ -1,36 +1,87 @@
-import json
+import select
 import socket
+import time
+
+from metrics import Metrics
+from protocol import (DEFAULT_CODEC, FrameDecoder, FramingError, choose_codec, decode_messages, encode_message,
+                      read_frame_blocking, recv_available, send_all)
 
 
 class Communication:
-    def __init__(self, host, port):
+    def __init__(self, host, port, wire_format="json", metrics: Metrics = None):
         self.host = host
         self.port = port
+        self.wire_format = wire_format
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.bind((self.host, self.port))
         self.socket.listen(1)
         self.client_socket, self.addr = self.socket.accept()
         self.client_socket.setblocking(0)
+        self.peer_closed = False
+        # Set by every batch sent, cleared by the supervisor's next answer.
+        # The supervisor answers everything it read at once, so one frame
+        # back acknowledges all batches sent before it.
+        self.awaiting_reply = False
+        self.decoder = FrameDecoder()
+        # Batch sizes and bytes on the wire, in both directions
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.codec = self.handshake()
+
+    def handshake(self):
+        """Answer the supervisor's hello with the wire format to use."""
+        hello = DEFAULT_CODEC.decode(read_frame_blocking(self.client_socket, self.decoder))
+        codec = choose_codec(hello, self.wire_format)
+        send_all(self.client_socket, encode_message({"codec": codec.name}))
+        print(f"Using {codec.name} wire format.")
+        return codec
 
     def send_data(self, data_):
         try:
-            data_to_send = json.dumps(data_)
-            self.client_socket.sendall(data_to_send.encode("utf-8"))
+            message = encode_message(data_, self.codec)
+            send_all(self.client_socket, message)
+            self.awaiting_reply = True
+            self.metrics.observe("bytes_sent", len(message))
+            self.metrics.observe("batch_sent", len(data_))
         except (TypeError, ValueError, socket.error) as e:
             print("Error:", str(e))
 
-    def receive_dict(self):
+    def receive_dict(self, timeout=0.0):
+        """
+        Returns every event from all complete messages received so far.
+        With a timeout, waits up to that long for at least one complete message.
+        """
+        deadline = time.monotonic() + timeout
         try:
-            data = self.client_socket.recv(1024).decode("utf-8")
-            if data:
-                # print(f"Logged raw data from socket: {data}")
-                return json.loads(data)
-            return {}
-        except BlockingIOError:
-            return {}
-        except (json.JSONDecodeError, socket.error) as e:
+            while True:
+                data, self.peer_closed = recv_available(self.client_socket)
+                frames = self.decoder.feed(data) if data else []
+                if data:
+                    self.metrics.observe("bytes_received", len(data))
+                if frames:
+                    self.awaiting_reply = False
+                    # print(f"Logged raw data from socket: {data}")
+                    events = decode_messages(frames, self.codec)
+                    self.metrics.observe("batch_received", len(events))
+                    return events
+                remaining = deadline - time.monotonic()
+                if self.peer_closed or remaining <= 0:
+                    return []
+                select.select([self.client_socket], [], [], remaining)
+        except FramingError as e:
             print("Error:", e)
-            return {}
+            self.lose_connection()
+            return []
+        except (ValueError, socket.error) as e:
+            print("Error:", e)
+            return []
+
+    def lose_connection(self):
+        """Stop reading from a stream that cannot be decoded any more, as if the supervisor had left."""
+        self.peer_closed = True
+        try:
+            self.client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
     def run(self, events_to_send):
         self.send_data(events_to_send)
@@ -0,0 +1,130 @@
+import json
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from typing import NamedTuple
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+DEBUG = LEVELS["debug"]
+
+
+class Dump(NamedTuple):
+    """Request to the writer thread: these records into their own file."""
+    path: str
+    records: list
+
+
+class EventLog:
+    """
+    Structured log: a record is a message with keyword fields, written as
+    one JSON line. Every record goes into an in-memory ring buffer holding
+    the last `capacity` of them, whatever its level; turning it into JSON
+    waits until it is written. Records at `level` or above are also handed
+    to a background thread that writes them to `path` (stderr without one),
+    so the caller never blocks on the output.
+
+    The default level is info and hot paths log at debug, so they are
+    silent but what happened last can still be dumped from the ring, with
+    dump() or by sending SIGUSR2.
+    """
+
+    def __init__(self, source, level="info", path=None, capacity=10000):
+        self.source = source
+        self.level = LEVELS[level]
+        self.path = path
+        self.ring = deque(maxlen=capacity)
+        self.pending = queue.SimpleQueue()
+        self.writer = None
+        self.dumps = 0
+
+    def configure(self, level="info", path=None, capacity=10000):
+        self.level = LEVELS[level]
+        self.path = path
+        self.ring = deque(self.ring, maxlen=capacity)
+
+    def configure_from(self, config):
+        self.configure(config.get("log_level", "info"), config.get(f"log_file_{self.source}"),
+                       config.get("log_buffer", 10000))
+
+    def log(self, level, message, **fields):
+        record = (time.time(), level, message, fields)
+        self.ring.append(record)
+        if LEVELS[level] >= self.level:
+            if self.writer is None:
+                self.start()
+            self.pending.put(record)
+
+    def debug(self, message, **fields):
+        # The hot-path level: usually only the ring buffer, so skip the extra call of log()
+        record = (time.time(), "debug", message, fields)
+        self.ring.append(record)
+        if self.level <= DEBUG:
+            if self.writer is None:
+                self.start()
+            self.pending.put(record)
+
+    def info(self, message, **fields):
+        self.log("info", message, **fields)
+
+    def warning(self, message, **fields):
+        self.log("warning", message, **fields)
+
+    def error(self, message, **fields):
+        self.log("error", message, **fields)
+
+    def format(self, record):
+        timestamp, level, message, fields = record
+        return json.dumps({"time": timestamp, "level": level, "source": self.source, "message": message, **fields},
+                          default=str)
+
+    def dump(self, path=None):
+        """Write the ring buffer, oldest record first, to path (or <source>-log-<n>.jsonl)."""
+        self.dumps += 1
+        if path is None:
+            path = f"{self.source}-log-{self.dumps:03}.jsonl"
+        records = list(self.ring)
+        if self.writer is None:
+            self.start()
+        self.pending.put(Dump(path, records))
+        return path
+
+    def install_signal(self):
+        """SIGUSR2 dumps the ring buffer of a running process."""
+        if hasattr(signal, "SIGUSR2"):
+            signal.signal(signal.SIGUSR2, lambda signum, frame: self.dump())
+
+    def start(self):
+        self.writer = threading.Thread(target=self.write_loop, name=f"{self.source}-log", daemon=True)
+        self.writer.start()
+
+    def write_loop(self):
+        output = open(self.path, "a", encoding="utf-8") if self.path else sys.stderr
+        try:
+            while True:
+                item = self.pending.get()
+                if item is None:
+                    break
+                if isinstance(item, Dump):
+                    with open(item.path, "w", encoding="utf-8") as f:
+                        f.writelines(self.format(record) + "\n" for record in item.records)
+                    output.write(self.format((time.time(), "info", "log dumped",
+                                              {"path": os.path.abspath(item.path), "records": len(item.records)})) + "\n")
+                else:
+                    output.write(self.format(item) + "\n")
+                if self.pending.empty():
+                    output.flush()
+        finally:
+            output.flush()
+            if output is not sys.stderr:
+                output.close()
+
+    def close(self):
+        """Write out what is still queued and stop the writer."""
+        if self.writer is not None:
+            self.pending.put(None)
+            self.writer.join()
+            self.writer = None
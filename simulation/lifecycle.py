@@ -0,0 +1,97 @@
+import time
+from collections import deque
+
+import numpy as np
+
+# Steps of an order's life, in the order they happen
+STEPS = ("new_order", "food_start", "food_ready", "robot_arrived", "food_picked", "food_delivered")
+
+# Legs reported for every delivered order: name -> (from step, to step)
+LEGS = {
+    "wait_for_robot": ("new_order", "robot_arrived"),
+    "wait_at_restaurant": ("robot_arrived", "food_picked"),
+    "delivery": ("food_picked", "food_delivered"),
+    "total": ("new_order", "food_delivered"),
+}
+
+PERCENTILES = (50, 95, 99)
+
+# Percentiles are taken over the last WINDOW delivered orders
+WINDOW = 10000
+# An order not delivered this many ticks after it was first seen is given up on
+MAX_AGE = 1000
+
+
+class OrderLifecycle:
+    """
+    Tick and wall time at which every order went through each of STEPS.
+    Once an order is delivered the length of each of its LEGS is kept, in
+    ticks and in seconds, and the order itself is dropped. Only the last
+    `window` lengths of a leg are kept, so memory and the cost of a report
+    stay the same however long the run is. Orders that are still open
+    `max_age` ticks after they were first seen (their robot died, say) are
+    dropped and counted as abandoned.
+    """
+
+    def __init__(self, window=WINDOW, max_age=MAX_AGE):
+        self.max_age = max_age
+        self.open = {}  # order number -> {step: (tick, wall time)}, oldest first
+        self.delivered = {leg: 0 for leg in LEGS}
+        self.ticks = {leg: deque(maxlen=window) for leg in LEGS}
+        self.seconds = {leg: deque(maxlen=window) for leg in LEGS}
+        self.abandoned = 0
+        self.last_eviction = 0
+
+    def mark(self, order_number, step, tick):
+        if tick - self.last_eviction >= self.max_age:
+            self.evict(tick)
+        steps = self.open.setdefault(order_number, {})
+        # Only the first time, a robot can come to the restaurant again for the same order
+        if step not in steps:
+            steps[step] = (tick, time.time())
+        if step == "food_delivered":
+            self.finish(order_number)
+
+    def finish(self, order_number):
+        steps = self.open.pop(order_number)
+        for leg, (start, end) in LEGS.items():
+            if start in steps and end in steps:
+                self.delivered[leg] += 1
+                self.ticks[leg].append(steps[end][0] - steps[start][0])
+                self.seconds[leg].append(steps[end][1] - steps[start][1])
+
+    def evict(self, tick):
+        """Drop orders first seen more than max_age ticks before tick."""
+        self.last_eviction = tick
+        stale = []
+        # Orders are added when first seen, so the oldest come first
+        for order_number, steps in self.open.items():
+            if min(step_tick for step_tick, _ in steps.values()) > tick - self.max_age:
+                break
+            stale.append(order_number)
+        for order_number in stale:
+            del self.open[order_number]
+        self.abandoned += len(stale)
+
+    def percentiles(self):
+        """
+        {leg: {"count": n, "window": m, "ticks": {"p50": ..., ...}, "seconds": {...}}},
+        count over all delivered orders, the percentiles over the last window of them.
+        """
+        result = {}
+        for leg in LEGS:
+            if not self.ticks[leg]:
+                continue
+            result[leg] = {"count": self.delivered[leg], "window": len(self.ticks[leg])}
+            for unit, samples in (("ticks", self.ticks[leg]), ("seconds", self.seconds[leg])):
+                values = np.percentile(samples, PERCENTILES)
+                result[leg][unit] = {f"p{q}": float(value) for q, value in zip(PERCENTILES, values)}
+        return result
+
+    def report(self):
+        for leg, stats in self.percentiles().items():
+            ticks = " ".join(f"{name} {value:5.1f}" for name, value in stats["ticks"].items())
+            seconds = " ".join(f"{name} {value:6.3f}" for name, value in stats["seconds"].items())
+            print(f"{leg:18}: {stats['count']:5} orders | ticks {ticks} | seconds {seconds}")
+        if self.abandoned:
+            print(f"{'abandoned':18}: {self.abandoned:5} orders not delivered within {self.max_age} ticks")
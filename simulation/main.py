@@ -1,14 +1,23 @@
+import argparse
+import heapq
+import itertools
 import json
-import os
 import random
-import sys
+import time
 from collections import deque
 from enum import Enum
 
-import pygame
+import numpy as np
 
+from city import generate_buildings, get_restaurants
 from communication import Communication
-from render import Renderer
+from eventlog import EventLog
+from lifecycle import OrderLifecycle
+from metrics import Metrics, metrics_from_config
+from profiling import profiler_from_config
+from protocol import BinaryCodec, EventType, JsonCodec
+from recorder import FROM_SUPERVISOR, TO_SUPERVISOR, EventRecorder
+from road_network import STEPS, RoadNetwork
 
 
 class Objective(Enum):
@@ -18,30 +27,16 @@ class Objective(Enum):
     GOING_WITH_ORDER = 3
     RETURNING_TO_BASE = 4
 
-# Event Types
-DEBUG: bool = False
+# Batches to and from the supervisor and robot spawns and removals are logged at
+# debug: kept in the ring buffer and dumped on SIGUSR2, written only with log_level debug
+log = EventLog("simulation")
 
-
-class EventType(Enum):
-    NEW_ORDER = "new_order"
-    SPAWN_COURIER = "robot_spawn"
-    ID_OF_SPAWNED_ROBOT = "id_of_spawned_robot"
-    RETURN_TO_BASE = "robot_return"
-    ARRIVED_AT_BASE = "robot_returned"
-    LOW_BATTERY_WARNING = "battery_low"
-    BATTERY_DEPLETED = "battery_dead"
-    ARRIVED_AT_RESTAURANT = "robot_arrived"
-    ROBOT_PICK_FOOD = "robot_pick"
-    FOOD_PICKED_UP = "food_picked"
-    FOOD_READY = "food_ready"
-    DELIVER_FOOD = "robot_deliver"
-    FOOD_DELIVERED = "food_delivered"
-    BACKPACK_EMPTIED = "robot_empty"  # "plecak_skurwiela_oprozniony"
-    FOOD_START = "food_start"
+# Below this part of the full range a robot warns about its battery
+LOW_BATTERY_FRACTION = 0.17
 
 
 class Robot:
-    def __init__(self, robot_id, x, y, battery_range, backpack_capacity, event_queue, road_spacing):
+    def __init__(self, robot_id, x, y, battery_range, backpack_capacity, event_queue, road_network):
         self.robot_id = robot_id
         self.x = x
         self.y = y
@@ -57,13 +52,34 @@ class Robot:
         self.orders = {}
         self.deliveries = {}
         self.restaurant_at_which_robot_waits = []
-        self.road_spacing = road_spacing
+        # Targets to go to after the current one, (x, y, objective)
+        self.waypoints = deque()
+        self.road_network: RoadNetwork = road_network
+
+    def is_busy(self):
+        """Driving somewhere or waiting for food, see Fleet.busy_count."""
+        return self.target_x is not None or self.current_objective == Objective.WAITING_FOR_FOOD_TO_BE_READY
+
+    def has_low_battery(self):
+        return self.current_battery_range <= LOW_BATTERY_FRACTION * self.battery_range
 
     def set_target(self, tx, ty, type: Objective):
         self.target_x = tx
         self.target_y = ty
         self.current_objective = type
 
+    def queue_target(self, tx, ty, type: Objective):
+        """Go to the target now if the robot is free, otherwise once it is done with the ones before."""
+        if self.target_x is None and self.current_objective == Objective.IDLE:
+            self.set_target(tx, ty, type)
+        elif (tx, ty, type) != (self.target_x, self.target_y, self.current_objective) \
+                and (tx, ty, type) not in self.waypoints:
+            self.waypoints.append((tx, ty, type))
+
+    def next_waypoint(self):
+        if self.waypoints and self.current_objective == Objective.IDLE:
+            self.set_target(*self.waypoints.popleft())
+
     def add_order(self, restaurant, order_number, food):
         self.orders[order_number] = {"restaurant": restaurant, "ready_flag": False, "food": food}
 
@@ -74,8 +90,9 @@ class Robot:
         self.orders[order_number]["ready_flag"] = True
 
     def pickup_food(self, restaurant):
-        """Add food to backpack, simulating pickup of an order from restaurant"""
-        order_to_remove_from_dict = -1
+        """Add food to backpack, simulating pickup of every ready order from restaurant"""
+        picked_orders = []
+        waiting = False
         for order_number, order_param in self.orders.items():
             restaurant_location = order_param["restaurant"]
             if restaurant_location != restaurant:
@@ -93,19 +110,26 @@ class Robot:
                     "food": order_param["food"],
                     "restaurant": restaurant,
                 })
-                self.current_objective = Objective.IDLE
-                self.restaurant_at_which_robot_waits = []
-                order_to_remove_from_dict = order_number
+                picked_orders.append(order_number)
 
             else:
-                self.current_objective = Objective.WAITING_FOR_FOOD_TO_BE_READY
-                self.restaurant_at_which_robot_waits = restaurant
-        if order_to_remove_from_dict >= 0:
-            del self.orders[order_to_remove_from_dict]
+                waiting = True
+
+        for order_number in picked_orders:
+            del self.orders[order_number]
+
+        # Keep waiting as long as any order from this restaurant is still being prepared
+        if waiting:
+            self.current_objective = Objective.WAITING_FOR_FOOD_TO_BE_READY
+            self.restaurant_at_which_robot_waits = restaurant
+        else:
+            self.current_objective = Objective.IDLE
+            self.restaurant_at_which_robot_waits = []
+            self.next_waypoint()
 
     def give_food(self, address):
         """Remove food from backpack, simulating giving order to customer"""
-        delivery_to_remove_from_dict = -1
+        delivered_orders = []
         for order_number, delivery_parameters in self.deliveries.items():
             destination = delivery_parameters["address"]
             if destination != address:
@@ -113,7 +137,7 @@ class Robot:
 
             removed_capacity = delivery_parameters["food"]["size"]
             self.current_capacity -= removed_capacity
-            delivery_to_remove_from_dict = order_number
+            delivered_orders.append(order_number)
 
             self.event_queue.enqueue({
                 "id": EventType.FOOD_DELIVERED.value,
@@ -121,43 +145,59 @@ class Robot:
                 "address": address,
             })
 
-            # Generate event: Backpack emptied
-            if self.current_capacity == 0:
-                self.event_queue.enqueue({
-                    "id": EventType.BACKPACK_EMPTIED.value,
-                    "robot_number": self.robot_id
-                })
+        for order_number in delivered_orders:
+            del self.deliveries[order_number]
+
+        # Generate event: Backpack emptied
+        if delivered_orders and self.current_capacity == 0:
+            self.event_queue.enqueue({
+                "id": EventType.BACKPACK_EMPTIED.value,
+                "robot_number": self.robot_id
+            })
 
-        if delivery_to_remove_from_dict >= 0:
-            del self.deliveries[delivery_to_remove_from_dict]
+    def arrive(self):
+        # Generate event: Arrived at destination
+        if self.current_objective == Objective.PICKING_UP:
+            self.event_queue.enqueue({
+                "id": EventType.ARRIVED_AT_RESTAURANT.value,
+                "robot_number": self.robot_id,
+                "restaurant": [self.target_x, self.target_y],
+            })
+        elif self.current_objective == Objective.GOING_WITH_ORDER:
+            self.give_food([self.x, self.y])
+        elif self.target_x == 0 and self.target_y == 0 and self.current_objective == Objective.RETURNING_TO_BASE:
+            self.current_battery_range = self.battery_range
+            self.event_queue.enqueue({
+                "id": EventType.ARRIVED_AT_BASE.value,
+                "robot_number": self.robot_id,
+            })
+
+        # Clear target
+        arrived_objective = self.current_objective
+        self.target_x = None
+        self.target_y = None
+        self.current_objective = Objective.IDLE
+        # At a restaurant the robot first waits for the food, pickup_food moves it on
+        if arrived_objective != Objective.PICKING_UP:
+            self.next_waypoint()
 
     def move(self):
         """
-        Simple "taxi-like" movement (Manhattan distance):
-        - If a target is set, we move towards the target along the X-axis first, then along the Y-axis (or vice versa).
-        - No obstacle avoidance.
+        Movement along the roads:
+        - If a target is set, we take one step on the shortest road path to it (RoadNetwork.next_step).
+        - Buildings are only entered at the end of the path.
         """
         if self.current_objective == Objective.WAITING_FOR_FOOD_TO_BE_READY:
             self.pickup_food(self.restaurant_at_which_robot_waits)
 
         if self.target_x is not None and self.target_y is not None:
-            if self.y < self.target_y:
-                self.y += 1
-            elif self.y > self.target_y:
-                self.y -= 1
-            elif self.x < self.target_x:
-                self.x += 1
-            elif self.x > self.target_x:
-                self.x -= 1
-
-            # self.x, self.y = self.adjust_to_road(
-            #     self.x, self.y, self.road_spacing)
+            self.x, self.y = self.road_network.next_step((self.x, self.y), (self.target_x, self.target_y))
 
             # Każdy krok zużywa 1 "jednostkę" baterii
             self.current_battery_range -= 1
 
             # Low battery warning
-            if self.current_battery_range <= 0.17 * self.battery_range:
+            if self.has_low_battery():
                 self.event_queue.enqueue({
                     "id": EventType.LOW_BATTERY_WARNING.value,
                     "robot_number": self.robot_id
@@ -165,26 +205,7 @@ class Robot:
 
             # Sprawdzamy, czy dotarliśmy do celu
             if self.x == self.target_x and self.y == self.target_y:
-                # Generate event: Arrived at destination
-                if self.current_objective == Objective.PICKING_UP:
-                    self.event_queue.enqueue({
-                        "id": EventType.ARRIVED_AT_RESTAURANT.value,
-                        "robot_number": self.robot_id,
-                        "restaurant": [self.target_x, self.target_y],
-                    })
-                elif self.current_objective == Objective.GOING_WITH_ORDER:
-                    self.give_food([self.x, self.y])
-                elif self.target_x == 0 and self.target_y == 0 and self.current_objective == Objective.RETURNING_TO_BASE:
-                    self.current_battery_range = self.battery_range
-                    self.event_queue.enqueue({
-                        "id": EventType.ARRIVED_AT_BASE.value,
-                        "robot_number": self.robot_id,
-                    })
-
-                # Clear target
-                self.target_x = None
-                self.target_y = None
-                self.current_objective = Objective.IDLE
+                self.arrive()
 
         # Battery depleted
         if self.current_battery_range <= 0:
@@ -194,42 +215,265 @@ class Robot:
             })
 
 
+def fleet_attribute(name, to_array=int, from_array=int):
+    """Robot attribute kept in the Fleet array of that name, at the robot's slot."""
+    def get(robot):
+        return from_array(getattr(robot.fleet, name)[robot.slot])
+
+    def set(robot, value):
+        getattr(robot.fleet, name)[robot.slot] = to_array(value)
+
+    return property(get, set)
+
+
+NO_TARGET = -1
+
+
+class FleetRobot(Robot):
+    """Robot whose position, target, battery and objective live in the arrays of a Fleet."""
+    x = fleet_attribute("x")
+    y = fleet_attribute("y")
+    target_x = fleet_attribute("target_x", lambda value: NO_TARGET if value is None else value,
+                               lambda value: None if value == NO_TARGET else int(value))
+    target_y = fleet_attribute("target_y", lambda value: NO_TARGET if value is None else value,
+                               lambda value: None if value == NO_TARGET else int(value))
+    battery_range = fleet_attribute("battery_range")
+    current_battery_range = fleet_attribute("battery")
+    current_objective = fleet_attribute("objective", lambda objective: objective.value, Objective)
+
+    def __init__(self, fleet, slot, *args):
+        self.fleet = fleet
+        self.slot = slot
+        super().__init__(*args)
+
+
+class Fleet:
+    """
+    Struct-of-arrays storage of the robots: positions, targets, battery and
+    objectives are NumPy arrays indexed by the robot's slot, so one call to
+    step() moves every robot at once instead of calling Robot.move on each.
+    Robots that arrive, run low or run out of battery are picked out with
+    boolean masks and only those go through Python. The events are the same
+    and come in the same order as from the per-object loop.
+    """
+    FIELDS = ("x", "y", "target_x", "target_y", "battery_range", "battery", "objective")
+
+    def __init__(self, event_queue, road_network: RoadNetwork, capacity=64):
+        self.event_queue: EventQueue = event_queue
+        self.road_network = road_network
+        self.robots: list[FleetRobot] = []  # by slot, in spawn order like the robots list in main
+        for name in self.FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=np.int64))
+        self.active = np.zeros(capacity, dtype=bool)
+
+    def grow(self):
+        for name in self.FIELDS + ("active",):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+
+    def spawn(self, robot_id, x, y, battery_range, backpack_capacity):
+        slot = len(self.robots)
+        if slot == len(self.active):
+            self.grow()
+        self.active[slot] = True
+        robot = FleetRobot(self, slot, robot_id, x, y, battery_range, backpack_capacity,
+                           self.event_queue, self.road_network)
+        self.robots.append(robot)
+        return robot
+
+    def remove(self, robot: FleetRobot):
+        self.active[robot.slot] = False
+
+    def busy_count(self):
+        n = len(self.robots)
+        waiting = self.objective[:n] == Objective.WAITING_FOR_FOOD_TO_BE_READY.value
+        return int(np.count_nonzero(self.active[:n] & ((self.target_x[:n] != NO_TARGET) | waiting)))
+
+    def step(self):
+        """Robot.move for every active robot."""
+        n = len(self.robots)
+        # main() drops robots without any battery range instead of moving them
+        active = self.active[:n] & (self.battery_range[:n] > 0)
+        x, y = self.x[:n], self.y[:n]
+        target_x, target_y = self.target_x[:n], self.target_y[:n]
+        battery = self.battery[:n]
+        queue = self.event_queue.queue
+
+        # Robots waiting in a restaurant try to pick up their food first. Their
+        # events are taken back off the queue to be put in robot order at the end.
+        picked = {}
+        waiting = active & (self.objective[:n] == Objective.WAITING_FOR_FOOD_TO_BE_READY.value)
+        for slot in np.flatnonzero(waiting).tolist():
+            robot = self.robots[slot]
+            queued = len(queue)
+            robot.pickup_food(robot.restaurant_at_which_robot_waits)
+            events = [queue.pop() for _ in range(len(queue) - queued)]
+            if events:
+                picked[slot] = events[::-1]
+
+        # One step along the road for every robot with a target, grouped by target
+        moving = np.flatnonzero(active & (target_x != NO_TARGET))
+        low = arrived = ()
+        if len(moving):
+            keys = target_x[moving] * self.road_network.height + target_y[moving]
+            order = np.argsort(keys, kind="stable")
+            targets, counts = np.unique(keys[order], return_counts=True)
+            for key, slots in zip(targets.tolist(), np.split(moving[order], np.cumsum(counts)[:-1])):
+                steps = self.road_network.steps_to(divmod(key, self.road_network.height))[x[slots], y[slots]]
+                stepping = steps >= 0
+                x[slots[stepping]] += STEPS[steps[stepping], 0]
+                y[slots[stepping]] += STEPS[steps[stepping], 1]
+
+            # Każdy krok zużywa 1 "jednostkę" baterii
+            battery[moving] -= 1
+            low = moving[battery[moving] <= LOW_BATTERY_FRACTION * self.battery_range[moving]].tolist()
+            arrived = moving[(x[moving] == target_x[moving]) & (y[moving] == target_y[moving])].tolist()
+        depleted = np.flatnonzero(active & (battery <= 0)).tolist()
+
+        low, arrived = set(low), set(arrived)
+        for slot in sorted(picked.keys() | low | arrived | set(depleted)):
+            robot = self.robots[slot]
+            queue.extend(picked.get(slot, ()))
+            if slot in low:
+                self.event_queue.enqueue({
+                    "id": EventType.LOW_BATTERY_WARNING.value,
+                    "robot_number": robot.robot_id
+                })
+            if slot in arrived:
+                robot.arrive()
+            # Arriving at the base recharges the robot
+            if battery[slot] <= 0:
+                self.event_queue.enqueue({
+                    "id": EventType.BATTERY_DEPLETED.value,
+                    "robot_number": robot.robot_id
+                })
+
+
+class TimerQueue:
+    """
+    Actions due at a later tick, in a min-heap keyed by that tick, so a tick
+    only touches the timers that run out in it instead of counting every
+    one down. Anything that waits in simulation time (food preparation,
+    charging, a trip with a known arrival) can schedule here.
+
+    Timers due on the same tick run by priority, then in the order they
+    were scheduled.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.now = 0
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def schedule(self, delay, action, *args, priority=0):
+        """Run action(*args) delay ticks from now. Returns a handle for cancel."""
+        timer = [self.now + delay, priority, next(self.counter), action, args]
+        heapq.heappush(self.heap, timer)
+        return timer
+
+    def cancel(self, timer):
+        # Left in the heap and skipped when it comes up
+        timer[3] = None
+
+    def advance(self, tick):
+        """Move the clock to tick and run every action due by then."""
+        self.now = tick
+        heap = self.heap
+        while heap and heap[0][0] <= tick:
+            _, _, _, action, args = heapq.heappop(heap)
+            if action is not None:
+                action(*args)
+
+
 class Restaurant:
-    def __init__(self, x, y, event_queue):
+    def __init__(self, x, y, event_queue, rng=random, number=0):
         self.restaurant = [x, y]
         self.order_dict = dict()
+        self.ready_orders = set()
         self.event_queue: EventQueue = event_queue
+        self.rng = rng
+        # Position in the restaurant list, food ready on the same tick is reported in that order
+        self.number = number
 
     def give_order(self, order_number):
-        del self.order_dict[order_number]
+        """The food left with a robot, the restaurant forgets the order."""
+        self.order_dict.pop(order_number, None)
+        self.ready_orders.discard(order_number)
 
     def start_preparing_order(self, food_details, order_number):
-        time = random.randint(1, 15)
-        self.order_dict[order_number] = [food_details, time]
-
-    def restaurant_tick(self):
-        for order_number, order_details in self.order_dict.items():
-            if order_details[1] > 0:
-                order_details[1] -= 1
-
-                if order_details[1] == 0: # food ready
-                    self.event_queue.enqueue({
-                    "id": EventType.FOOD_READY.value,
-                    "order_number": order_number,
-                    "restaurant": self.restaurant,
-                    "food": order_details[0],
-                })
+        time = self.rng.randint(1, 15)
+        self.order_dict[order_number] = food_details
+        self.event_queue.timers.schedule(time, self.food_ready, order_number, priority=self.number)
+
+    def is_ready(self, order_number):
+        return order_number in self.ready_orders
+
+    def food_ready(self, order_number):
+        self.ready_orders.add(order_number)
+        self.event_queue.enqueue({
+            "id": EventType.FOOD_READY.value,
+            "order_number": order_number,
+            "restaurant": self.restaurant,
+            "food": self.order_dict[order_number],
+        })
 
 class EventQueue:
+    # Event type -> name of the method handling it. A new event type only needs
+    # its method and a line here; anything missing is logged and dropped.
+    HANDLERS = {
+        EventType.NEW_ORDER: "on_new_order",
+        EventType.SPAWN_COURIER: "on_spawn_courier",
+        EventType.RETURN_TO_BASE: "on_return_to_base",
+        EventType.ARRIVED_AT_BASE: "forward",  # NOTE Szpak: Supervisor currently does not use this event
+        EventType.LOW_BATTERY_WARNING: "forward",  # NOTE Szpak: Supervisor currently does not use this event
+        EventType.BATTERY_DEPLETED: "on_battery_depleted",
+        EventType.ARRIVED_AT_RESTAURANT: "on_arrived_at_restaurant",
+        EventType.ROBOT_PICK_FOOD: "on_robot_pick_food",
+        EventType.FOOD_PICKED_UP: "on_food_picked",
+        EventType.FOOD_READY: "on_food_ready",
+        EventType.DELIVER_FOOD: "on_deliver_food",
+        EventType.FOOD_DELIVERED: "on_food_delivered",
+        EventType.BACKPACK_EMPTIED: "forward",
+        EventType.FOOD_START: "on_food_start",
+    }
+
     def __init__(self):
         self.queue = deque()
         self.num_of_finished_orders = 0
         self.recharged_robots = []
+        self.tick = 0
+        # Events dispatched to handlers and the time it took, for the throughput summary
+        self.events_handled = 0
+        self.handling_time = 0.0
+        # Handling time by event type and queue depth, see metrics.Metrics
+        self.metrics = Metrics()
+        # When every order went through each step, see lifecycle.OrderLifecycle
+        self.lifecycle = OrderLifecycle()
+        self.recorder: EventRecorder = None
+        # Robots kept in a Fleet and moved by Fleet.step instead of Robot.move
+        self.fleet: Fleet = None
+        self.timers = TimerQueue()
+        self.handlers = {event_type.value: getattr(self, name) for event_type, name in self.HANDLERS.items()}
+        # Kept next to the robots list, so routing an event to its robot does not scan the fleet
+        self.robots_by_id: dict[int, Robot] = {}
+        # Orders given to a robot before their food was ready, until it is
+        self.robot_of_order: dict[int, Robot] = {}
+        self.restaurants_by_position = {}
+
+        # Set by process_events for the handlers
+        self.robots: list[Robot] = []
+        self.restaurants: list[Restaurant] = []
+        self.max_robots = 0
+        self.backpack_capacity = 0
+        self.next_robot_id = 0
+        self.road_network: RoadNetwork = None
+        self.messages_to_send = []
 
     def enqueue(self, event_dict: dict):
         self.queue.append(event_dict)
-        if DEBUG:
-            print(f"Enqueuing event: {event_dict}")
 
     def dequeue(self):
         return self.queue.popleft() if self.queue else None
@@ -237,201 +481,220 @@ class EventQueue:
     def is_empty(self):
         return len(self.queue) == 0
 
-    def process_events(self, robots: list[Robot], restaurants, max_robots, backpack_capacity, next_robot_id, communication: Communication, road_spacing):
-        messages_to_send = []
-
-        payload = communication.receive_dict()
+    def remove_robot(self, robot: Robot):
+        """Takes robot out of the simulation: the robots list, the id map and the fleet."""
+        self.robots.remove(robot)
+        self.robots_by_id.pop(robot.robot_id, None)
+        if self.fleet is not None:
+            self.fleet.remove(robot)
+
+    def restaurant_at(self, position):
+        if len(self.restaurants_by_position) != len(self.restaurants):
+            self.restaurants_by_position = {tuple(r.restaurant): r for r in self.restaurants}
+        return self.restaurants_by_position.get(tuple(position))
+
+    def process_events(self, robots: list[Robot], restaurants, max_robots, backpack_capacity, next_robot_id, communication: Communication, road_network: RoadNetwork, reply_timeout=0.0):
+        self.robots = robots
+        self.restaurants = restaurants
+        self.max_robots = max_robots
+        self.backpack_capacity = backpack_capacity
+        self.next_robot_id = next_robot_id
+        self.road_network = road_network
+        self.messages_to_send = []
+
+        # Wait only while the supervisor still owes an answer to what was sent last
+        payload = communication.receive_dict(reply_timeout if communication.awaiting_reply else 0.0)
+        if payload:
+            log.debug("rx", tick=self.tick, events=payload)
+        if self.recorder:
+            self.recorder.record(self.tick, FROM_SUPERVISOR, payload)
         for event in payload:
             event: dict
             self.enqueue(event)
 
+        self.handle_queue()
+
+        if self.messages_to_send:
+            log.debug("tx", tick=self.tick, events=self.messages_to_send)
+        communication.send_data(self.messages_to_send)
+        if self.recorder:
+            self.recorder.record(self.tick, TO_SUPERVISOR, self.messages_to_send)
+
+        return self.next_robot_id, self.num_of_finished_orders
+
+    def handle_queue(self):
+        """Run every queued event through its handler, until the queue is empty."""
+        metrics = self.metrics
+        metrics.observe("queue_depth", len(self.queue))
+        start = time.perf_counter()
         while not self.is_empty():
             event = self.dequeue()
+            self.events_handled += 1
             event_id = event.get("id", "")
-
-            if event_id == EventType.NEW_ORDER.value:
-                messages_to_send.append(
-                    event
-                )
-                if DEBUG:
-                    print(f"[EVENT] New order: {event}")
-
-            elif event_id == EventType.SPAWN_COURIER.value:
-                id_of_spawned_robot = -1
-                if self.recharged_robots:
-                    robot_id = self.recharged_robots.pop()
-                    for r in robots:
-                        if r.robot_id == robot_id:
-                            id_of_spawned_robot = robot_id
-                            if DEBUG:
-                                print(f"[EVENT] Spawning recharged robot with id: {robot_id}")
+            handler = self.handlers.get(event_id)
+            if handler is not None:
+                handler_start = time.perf_counter()
+                handler(event)
+                metrics.time(event_id, time.perf_counter() - handler_start)
+            else:
+                log.debug("unknown event", tick=self.tick, event=event)
+        self.handling_time += time.perf_counter() - start
+
+    def forward(self, event):
+        """Events only passed on to the supervisor."""
+        self.messages_to_send.append(event)
+
+    def on_new_order(self, event):
+        self.lifecycle.mark(event["order_number"], "new_order", self.tick)
+        self.forward(event)
+
+    def on_food_picked(self, event):
+        self.lifecycle.mark(event["order_number"], "food_picked", self.tick)
+        restaurant_obj = self.restaurant_at(event["restaurant"])
+        if restaurant_obj is not None:
+            restaurant_obj.give_order(event["order_number"])
+        self.forward(event)
+
+    def on_spawn_courier(self, event):
+        id_of_spawned_robot = -1
+        if self.recharged_robots:
+            robot_id = self.recharged_robots.pop()
+            if robot_id in self.robots_by_id:
+                id_of_spawned_robot = robot_id
+                log.debug("robot respawned", tick=self.tick, robot_number=robot_id)
+        else:
+            if len(self.robots) < self.max_robots:
+                if self.fleet is not None:
+                    r = self.fleet.spawn(self.next_robot_id, 0, 0, event.get("battery_range", 100), self.backpack_capacity)
                 else:
-                    if len(robots) < max_robots:
-                        r = Robot(next_robot_id, 0, 0, event.get(
-                            "battery_range", 100), backpack_capacity, self, road_spacing)
-                        robots.append(r)
-                        id_of_spawned_robot = next_robot_id
-                        if DEBUG:
-                            print(f"[EVENT] Spawned new courier: ID={next_robot_id}")
-                        next_robot_id += 1
-                    else:
-                        if DEBUG:
-                            print("[EVENT] Maximum number of robots reached.")
-                        # TODO: raise it to the supervisor
-
-                messages_to_send.append(
-                    {
-                        "id": EventType.ID_OF_SPAWNED_ROBOT.value,
-                        "robot_number": id_of_spawned_robot,
-                    }
-                )
-
-            elif event_id == EventType.RETURN_TO_BASE.value:
-                robot_id = event["robot_number"]
-                for r in robots:
-                    if r.robot_id == robot_id:
-                        r.set_target(0, 0, Objective.RETURNING_TO_BASE)
-                        if DEBUG:
-                            print(f"[EVENT] Robot {robot_id} returning to base.")
-
-            elif event_id == EventType.ARRIVED_AT_BASE.value:
-                # NOTE Szpak: Supervisor currently does not use this event
-                messages_to_send.append(
-                    event
-                )
-                robot_id = event["robot_number"]
-                if DEBUG:
-                    print(f"[EVENT] Robot {robot_id} arrived at base.")
-
-            elif event_id == EventType.LOW_BATTERY_WARNING.value:
-                # NOTE Szpak: Supervisor currently does not use this event
-                messages_to_send.append(
-                    event
-                )
-                robot_id = event["robot_number"]
-                if DEBUG:
-                    print(f"[EVENT] Warning: Robot {robot_id} has low battery.")
-
-            elif event_id == EventType.BATTERY_DEPLETED.value:
-                # NOTE Szpak: Supervisor currently does not use this event
-                robot_id = event["robot_number"]
-                messages_to_send.append(
-                    event
-                )
-                if DEBUG:
-                    print(f"[EVENT] Robot {robot_id} battery depleted. Removing from simulation.")
-                robots = [r for r in robots if r.robot_id != robot_id]
-                # TODO: handle situation when robot is handling order
-
-            elif event_id == EventType.ARRIVED_AT_RESTAURANT.value:
-                robot_id = event["robot_number"]
-                restaurant = event["restaurant"]
-                messages_to_send.append(
-                    event
-                )
-                if DEBUG:
-                    print(f"[EVENT] Robot {robot_id} arrived at restaurant {restaurant}.")
-                for r in robots:
-                    if r.robot_id == robot_id:
-                        r.pickup_food(restaurant)
-                        if DEBUG:
-                            print(f"[EVENT] Robot {robot_id} trying to pick food from restaurant {restaurant}.")
-
-            elif event_id == EventType.ROBOT_PICK_FOOD.value:
-                robot_id = event["robot_number"]
-                food = event["food"]
-                restaurant = event["restaurant"]
-                order_number = event["order_number"]
-
-                for r in robots:
-                    if r.robot_id == robot_id:
-                        r.set_target(
-                            restaurant[0], restaurant[1], Objective.PICKING_UP)
-                        r.add_order(restaurant, order_number, food)
-
-                if DEBUG:
-                    print(f"[EVENT] Send robot to pick order from restaurant, robot_id = {robot_id}, food = {food}, restaurant = {restaurant}")
-
-            elif event_id == EventType.FOOD_PICKED_UP.value:
-                messages_to_send.append(
-                    event
-                )
-                order_number = event["order_number"]
-                restaurant = event["restaurant"]
-                food_details = event["food"]
-                if DEBUG:
-                    print(f"[EVENT] Order number {order_number} picked from restaurant {restaurant}. Food: {food_details}")
-
-            elif event_id == EventType.FOOD_READY.value:
-                messages_to_send.append(
-                    event
-                )
-                restaurant = event["restaurant"]
-                order_number = event["order_number"]
-                food_details = event["food"]
-                for r in robots:
-                    if order_number in r.orders.keys():
-                        r.set_order_ready(order_number)
-
-                if DEBUG:
-                    print(f"[EVENT] Food ready for pickup at restaurant {restaurant}. Food: {food_details}")
-
-            elif event_id == EventType.DELIVER_FOOD.value:
-                robot_id = event["robot_number"]
-                address = event["address"]
-                food_details = event["food"]
-                order_number = event["order_number"]
-                for r in robots:
-                    if r.robot_id == robot_id:
-                        # TODO: Food information is not stored anywhere
-                        r.set_target(
-                            address[0], address[1], Objective.GOING_WITH_ORDER)
-                        r.add_delivery(address, order_number, food_details)
-                        if DEBUG:
-                            print(f"[EVENT] Robot {robot_id} delivering food to {address}. Food: {food_details}")
-
-            elif event_id == EventType.FOOD_DELIVERED.value:
-                messages_to_send.append(
-                    event
-                )
-                self.num_of_finished_orders += 1
-                order_number = event["order_number"]
-                address = event["address"]
-                if DEBUG:
-                    print(f"[EVENT] Robot {order_number} delivered food to {address}")
-
-            elif event_id == EventType.BACKPACK_EMPTIED.value:
-                messages_to_send.append(
-                    event
-                )
-                robot_id = event["robot_number"]
-                if DEBUG:
-                    print(f"[EVENT] Robot {robot_id}'s backpack has been emptied.")
-
-            elif event_id == EventType.FOOD_START.value:
-                restaurant = event["restaurant"]
-                food_details = event["food"]
-                order_number = event["order_number"]
-
-                for restaurant_obj in restaurants:
-                    if restaurant == restaurant_obj.restaurant:
-                        restaurant_obj.start_preparing_order(food_details, order_number)
-
-                if DEBUG:
-                    print(f"[EVENT] Restaurant {restaurant} preparing food. Food: {food_details}, {order_number}")
-
+                    r = Robot(self.next_robot_id, 0, 0, event.get(
+                        "battery_range", 100), self.backpack_capacity, self, self.road_network)
+                self.robots.append(r)
+                self.robots_by_id[r.robot_id] = r
+                id_of_spawned_robot = self.next_robot_id
+                log.debug("robot spawned", tick=self.tick, robot_number=self.next_robot_id)
+                self.next_robot_id += 1
             else:
-                if DEBUG:
-                    print(f"[EVENT] Unknown event type: {event_id}. Params: {event}")
-
-        communication.send_data(messages_to_send)
-
-        return next_robot_id, self.num_of_finished_orders
+                log.debug("robot limit reached", tick=self.tick, max_robots=self.max_robots)
+                # TODO: raise it to the supervisor
+
+        self.messages_to_send.append(
+            {
+                "id": EventType.ID_OF_SPAWNED_ROBOT.value,
+                "robot_number": id_of_spawned_robot,
+            }
+        )
+
+    def on_return_to_base(self, event):
+        robot_id = event["robot_number"]
+        r = self.robots_by_id.get(robot_id)
+        if r is not None:
+            r.set_target(0, 0, Objective.RETURNING_TO_BASE)
+
+    def on_battery_depleted(self, event):
+        # NOTE Szpak: Supervisor currently does not use this event
+        robot_id = event["robot_number"]
+        self.messages_to_send.append(event)
+        r = self.robots_by_id.get(robot_id)
+        if r is not None:
+            # In place, so the robot is gone from the list main() moves too
+            self.remove_robot(r)
+            log.debug("robot removed", tick=self.tick, robot_number=robot_id)
+        # TODO: handle situation when robot is handling order
+
+    def on_arrived_at_restaurant(self, event):
+        robot_id = event["robot_number"]
+        restaurant = event["restaurant"]
+        self.messages_to_send.append(event)
+        r = self.robots_by_id.get(robot_id)
+        if r is not None:
+            for order_number, order_param in r.orders.items():
+                if order_param["restaurant"] == restaurant:
+                    self.lifecycle.mark(order_number, "robot_arrived", self.tick)
+            r.pickup_food(restaurant)
+
+    def on_robot_pick_food(self, event):
+        robot_id = event["robot_number"]
+        food = event["food"]
+        restaurant = event["restaurant"]
+        order_number = event["order_number"]
+
+        r = self.robots_by_id.get(robot_id)
+        if r is not None:
+            r.queue_target(
+                restaurant[0], restaurant[1], Objective.PICKING_UP)
+            r.add_order(restaurant, order_number, food)
+            # Joined a robot already waiting there, it will not arrive again
+            if [r.x, r.y] == list(restaurant):
+                self.lifecycle.mark(order_number, "robot_arrived", self.tick)
+            # The food may have been ready before the order was given to this robot
+            restaurant_obj = self.restaurant_at(restaurant)
+            if restaurant_obj is not None and restaurant_obj.is_ready(order_number):
+                r.set_order_ready(order_number)
+            else:
+                self.robot_of_order[order_number] = r
+
+    def on_food_ready(self, event):
+        self.messages_to_send.append(event)
+        order_number = event["order_number"]
+        self.lifecycle.mark(order_number, "food_ready", self.tick)
+        r = self.robot_of_order.pop(order_number, None)
+        if r is not None and order_number in r.orders:
+            r.set_order_ready(order_number)
+
+    def on_deliver_food(self, event):
+        robot_id = event["robot_number"]
+        address = event["address"]
+        food_details = event["food"]
+        order_number = event["order_number"]
+        r = self.robots_by_id.get(robot_id)
+        if r is not None:
+            # TODO: Food information is not stored anywhere
+            r.queue_target(
+                address[0], address[1], Objective.GOING_WITH_ORDER)
+            r.add_delivery(address, order_number, food_details)
+
+    def on_food_delivered(self, event):
+        self.messages_to_send.append(event)
+        self.num_of_finished_orders += 1
+        order_number = event["order_number"]
+        self.lifecycle.mark(order_number, "food_delivered", self.tick)
+
+    def on_food_start(self, event):
+        restaurant = event["restaurant"]
+        food_details = event["food"]
+        order_number = event["order_number"]
+        self.lifecycle.mark(order_number, "food_start", self.tick)
+
+        restaurant_obj = self.restaurant_at(restaurant)
+        if restaurant_obj is not None:
+            restaurant_obj.start_preparing_order(food_details, order_number)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="RoboGlovo simulation")
+    parser.add_argument("port", type=int, help="port the supervisor connects to")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without pygame and without frame rate cap")
+    parser.add_argument("--ticks", type=int, default=0,
+                        help="stop after this many ticks (0 = run until closed)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="random seed, overrides the one in config.json")
+    parser.add_argument("--tick-rate", type=float, default=None,
+                        help="ticks per second with the window open, 0 = as fast as possible "
+                             "(overrides tick_rate in config.json)")
+    parser.add_argument("--config", metavar="PATH", default="config.json",
+                        help="configuration file, the supervisor has to read the same one")
+    parser.add_argument("--record", metavar="PATH", default=None,
+                        help="save every event exchanged with the supervisor to PATH")
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
+
     # 1. Wczytanie konfiguracji
-    with open("config.json", 'r', encoding='utf-8') as f:
+    with open(args.config, 'r', encoding='utf-8') as f:
         config = json.load(f)
 
     city_size = config["city_size"]  # [width, height], np. [10, 10]
@@ -439,91 +702,196 @@ def main():
     cell_size = config["cell_size"]    # in px
     backpack_capacity = config["backpack_capacity"]
     restaurant_count = config["restaurant_count"]  # liczba restauracji
-    road_spacing = 3  # Rozstaw dróg (stały)
+    road_spacing = config.get("road_spacing", 3)  # Rozstaw dróg, ten sam w supervisorze
+    headless = args.headless or config.get("headless", False)
+    if args.seed is not None:
+        config["seed"] = args.seed
+    seed = config.get("seed")
+
+    # Separate generators, so e.g. a different number of prepared orders
+    # does not shift the order stream. Without a seed every run is different.
+    city_rng = random.Random(None if seed is None else f"{seed}:city")
+    orders_rng = random.Random(None if seed is None else f"{seed}:orders")
+    kitchen_rng = random.Random(None if seed is None else f"{seed}:kitchen")
 
-    # 2. Inicjalizacja Pygame
-    clock = pygame.time.Clock()
+    log.configure_from(config)
+    log.install_signal()
 
     event_queue = EventQueue()
+    event_queue.metrics = metrics_from_config(config, "metrics_simulation")
+    event_queue.metrics.add_section("order_legs", event_queue.lifecycle.percentiles)
+    if args.record:
+        event_queue.recorder = EventRecorder(args.record, config)
 
-    # 3. Renderer
-    renderer = Renderer(city_size, cell_size, restaurant_count)
-    restaurants_positions = renderer.get_restaurants()
+    # 2. Miasto
+    buildings = generate_buildings(city_size, restaurant_count, road_spacing, city_rng)
+    restaurants_positions = get_restaurants(buildings)
+
+    # Road distances and paths to the base and to every restaurant, built once
+    road_network = RoadNetwork(city_size, road_spacing)
+    road_network.precompute([(0, 0)] + restaurants_positions)
+    if config.get("vectorized_fleet", False):
+        event_queue.fleet = Fleet(event_queue, road_network, max_robots)
 
     restaurants = []
-    for x_, y_ in restaurants_positions:
-        restaurants.append(Restaurant(x_, y_, event_queue))
+    for number, (x_, y_) in enumerate(restaurants_positions):
+        restaurants.append(Restaurant(x_, y_, event_queue, kitchen_rng, number))
+
+    # 3. Renderer (w trybie headless pygame nie jest w ogóle importowany)
+    if not headless:
+        import pygame
+
+        from render import Renderer
+
+        clock = pygame.time.Clock()
+        renderer = Renderer(city_size, cell_size, buildings, road_spacing)
+        # The view is redrawn at most fps times a second, between two ticks,
+        # so the simulation can run faster than it is drawn
+        tick_rate = args.tick_rate if args.tick_rate is not None else config.get("tick_rate", 2)
+        frame_interval = 1.0 / config.get("fps", 30)
+        last_frame = float("-inf")
 
     # 4. Communication
-    communication = Communication("localhost", int(sys.argv[1]))
+    communication = Communication("localhost", args.port, config.get("wire_format", "json"), event_queue.metrics)
+    # Headless runs in lockstep with the supervisor: each tick waits (up to reply_timeout)
+    # for its answer to the previous one, if that is still outstanding
+    reply_timeout = 1.0 if headless else 0.0
 
     # 5. Lista robotów i zmienna do przydzielania ID
     robots = []
     next_robot_id = 0
     order_number = 0
     number_of_generated_orders = 0
+    finished_orders = 0
+    busy_robot_ticks = 0
+    tick = 0
+    start_time = time.perf_counter()
+
+    # Off unless config "profile" or ROBOGLOVO_PROFILE is set, see profiling.Profiler
+    components = {
+        # Only the handlers: the receive includes the headless lockstep wait, which is idle time
+        "process_events": [EventQueue.handle_queue],
+        "receive (incl. wait)": [Communication.receive_dict],
+        "send": [Communication.send_data],
+        "Robot.move": [Robot.move, Fleet.step],
+        "json codec": [JsonCodec.encode, JsonCodec.decode],
+        "binary codec": [BinaryCodec.encode, BinaryCodec.decode],
+    }
+    if not headless:
+        components["renderer"] = [Renderer.update]
+    profiler = profiler_from_config(config, "simulation", components)
 
     running = True
 
-    while running:
-        # Obsługa zdarzeń Pygame (np. zamknięcie okna)
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-        # Generowanie losowych zamówień
-        if random.random() < 0.25:  # 5% szansa na tick
-            number_of_generated_orders += 1
-            address_x = random.randint(0, city_size[0] - 1)
-            address_y = random.randint(0, city_size[1] - 1)
-
-            if address_x == 0:
-                address_x = 1
-            elif (address_x) % 3 == 0:
-                address_x -= 1
-
-            if address_y == 0:
-                address_y = 1
-            elif (address_y) % 3 == 0:
-                address_y -= 1
-
-            rest_x, rest_y = random.choice(restaurants_positions)
-
-            food = {"size": random.randint(1, 3)}
-            event_queue.enqueue({
-                "id": EventType.NEW_ORDER.value,
-                "order_number": order_number,
-                "food": food,
-                "address": [address_x, address_y],
-                "restaurant": [rest_x, rest_y],
-            })
-            order_number += 1
+    try:
+        while running:
+            if not headless:
+                # Obsługa zdarzeń Pygame (np. zamknięcie okna)
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        running = False
+                    elif event.type in (pygame.VIDEORESIZE, pygame.VIDEOEXPOSE):
+                        renderer.invalidate()
+
+            # Generowanie losowych zamówień
+            if orders_rng.random() < 0.25:  # 5% szansa na tick
+                number_of_generated_orders += 1
+                address_x = orders_rng.randint(0, city_size[0] - 1)
+                address_y = orders_rng.randint(0, city_size[1] - 1)
+
+                if address_x == 0:
+                    address_x = 1
+                elif address_x % road_spacing == 0:
+                    address_x -= 1
+
+                if address_y == 0:
+                    address_y = 1
+                elif address_y % road_spacing == 0:
+                    address_y -= 1
+                # With no road next to it (wider blocks, the edge of the city) nobody could deliver there
+                address_x, address_y = road_network.nearest_reachable((address_x, address_y))
+
+                rest_x, rest_y = orders_rng.choice(restaurants_positions)
+
+                food = {"size": orders_rng.randint(1, 3)}
+                event_queue.enqueue({
+                    "id": EventType.NEW_ORDER.value,
+                    "order_number": order_number,
+                    "food": food,
+                    "address": [address_x, address_y],
+                    "restaurant": [rest_x, rest_y],
+                })
+                order_number += 1
 
-        # Ruch robotów
-        for r in robots[:]:
-            r: Robot
-            if r.battery_range > 0:
-                r.move()
+            # Ruch robotów
+            if event_queue.fleet is not None:
+                busy_robot_ticks += event_queue.fleet.busy_count()
+                event_queue.fleet.step()
             else:
-                if DEBUG:
-                    print(f"[SIM] Robot {r.robot_id} ma rozładowaną baterię i zostaje usunięty z symulacji.")
-                robots.remove(r)
-
-        for restaurant in restaurants:
-            restaurant.restaurant_tick()
-
-        # Przetwarzanie zdarzeń
-        next_robot_id, finished_orders = event_queue.process_events(
-            robots, restaurants, max_robots, backpack_capacity, next_robot_id, communication, road_spacing)
-
-        # Statystyki
-        print('Total orders: {:4} | Realized orders: {:4} | Percentage: {:5.2f}%'.format(number_of_generated_orders, finished_orders, 100.0 * float(finished_orders)/number_of_generated_orders if number_of_generated_orders != 0 else 0.0), end='\r')
-
-        # Renderowanie
-        renderer.update(robots)
-        clock.tick(2)  # 2 FPS – można zmienić w zależności od potrzeb
-
-    pygame.quit()
+                for r in robots[:]:
+                    r: Robot
+                    if r.battery_range > 0:
+                        if r.is_busy():
+                            busy_robot_ticks += 1
+                        r.move()
+                    else:
+                        event_queue.remove_robot(r)
+                        log.debug("robot removed", tick=tick, robot_number=r.robot_id)
+
+            event_queue.timers.advance(tick)
+
+            # Przetwarzanie zdarzeń
+            event_queue.tick = tick
+            next_robot_id, finished_orders = event_queue.process_events(
+                robots, restaurants, max_robots, backpack_capacity, next_robot_id, communication, road_network,
+                reply_timeout)
+            event_queue.metrics.maybe_write()
+            tick += 1
+            if profiler:
+                profiler.step()
+
+            frame_due = not headless and time.perf_counter() - last_frame >= frame_interval
+
+            # Statystyki
+            if frame_due or tick % 100 == 0:
+                print('Total orders: {:4} | Realized orders: {:4} | Percentage: {:5.2f}%'.format(number_of_generated_orders, finished_orders, 100.0 * float(finished_orders)/number_of_generated_orders if number_of_generated_orders != 0 else 0.0), end='\r')
+
+            if headless:
+                if communication.peer_closed or tick == args.ticks:
+                    running = False
+            else:
+                # Renderowanie we własnym tempie, symulacja nie czeka na każdą klatkę
+                if frame_due:
+                    renderer.update(robots)
+                    last_frame = time.perf_counter()
+                if tick_rate:
+                    clock.tick(tick_rate)
+                if tick == args.ticks:
+                    running = False
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if profiler:
+            profiler.stop()
+        elapsed = time.perf_counter() - start_time
+        print()
+        print('Ticks: {} in {:.2f} s | {:.1f} ticks/s | {:.1f} orders/s generated | {:.1f} orders/s realized'.format(
+            tick, elapsed, tick / elapsed, number_of_generated_orders / elapsed, finished_orders / elapsed))
+        # Throughput per robot: orders delivered per 100 ticks a robot spent working on them
+        print('Busy robot ticks: {} | {:.2f} orders per 100 robot ticks'.format(
+            busy_robot_ticks, 100.0 * finished_orders / busy_robot_ticks if busy_robot_ticks else 0.0))
+        print('Events handled: {} in {:.3f} s | {:.0f} events/s'.format(
+            event_queue.events_handled, event_queue.handling_time,
+            event_queue.events_handled / event_queue.handling_time if event_queue.handling_time else 0.0))
+        event_queue.lifecycle.report()
+        communication.close()
+        event_queue.metrics.write()
+        if event_queue.recorder:
+            event_queue.recorder.close()
+        log.close()
+
+    if not headless:
+        pygame.quit()
 
 
 if __name__ == "__main__":
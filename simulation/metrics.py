@@ -0,0 +1,109 @@
+import json
+import math
+import os
+import time
+from collections import defaultdict
+
+# Bucket i of a histogram counts values in [2**(i-1), 2**i), bucket 0 everything below 1
+BUCKETS = 40
+
+
+class Histogram:
+    """Count, sum, maximum and power-of-two buckets of the values added."""
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, value, count=1):
+        """Add value count times."""
+        self.count += count
+        self.total += value * count
+        if value > self.max:
+            self.max = value
+        bucket = math.frexp(value)[1] if value >= 1 else 0
+        self.buckets[min(bucket, BUCKETS - 1)] += count
+
+    def percentile(self, q):
+        """The q-th percentile, interpolated linearly inside the bucket holding it."""
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                low = 2 ** (bucket - 1) if bucket else 0
+                return min(low + (2 ** bucket - low) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else 0,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "buckets": {f"<{2 ** bucket}": count for bucket, count in enumerate(self.buckets) if count},
+        }
+
+
+class Metrics:
+    """
+    Histograms kept in memory: timings in microseconds by name (an event
+    type, or a step like dispatch) and plain values such as batch sizes,
+    bytes on the wire or queue depth. Recording one is a few additions, so
+    it is always on. With a path, maybe_write puts a JSON snapshot of
+    everything there at most every interval seconds.
+    """
+
+    def __init__(self, path=None, interval=5.0):
+        self.path = path
+        self.interval = interval
+        self.started = time.time()
+        self.last_write = time.monotonic()
+        self.timings = defaultdict(Histogram)
+        self.values = defaultdict(Histogram)
+        # name -> function returning more data for the snapshot
+        self.sections = {}
+
+    def time(self, name, seconds):
+        self.timings[name].add(seconds * 1e6)
+
+    def observe(self, name, value):
+        self.values[name].add(value)
+
+    def add_section(self, name, source):
+        self.sections[name] = source
+
+    def snapshot(self):
+        snapshot = {
+            "time": time.time(),
+            "uptime": time.time() - self.started,
+            "timings_us": {name: histogram.snapshot() for name, histogram in sorted(self.timings.items())},
+            "values": {name: histogram.snapshot() for name, histogram in sorted(self.values.items())},
+        }
+        for name, source in self.sections.items():
+            snapshot[name] = source()
+        return snapshot
+
+    def maybe_write(self):
+        if self.path and time.monotonic() - self.last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        """Replace the snapshot file at once, a reader never sees half of it."""
+        if not self.path:
+            return
+        self.last_write = time.monotonic()
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(temporary, self.path)
+
+
+def metrics_from_config(config, key):
+    """Metrics writing to the path config[key], if there is one."""
+    return Metrics(config.get(key), config.get("metrics_interval", 5.0))
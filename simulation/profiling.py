@@ -0,0 +1,134 @@
+import cProfile
+import io
+import os
+import pstats
+import signal
+import time
+import tracemalloc
+
+# Switch profiling on without touching config.json
+PROFILE_ENV = "ROBOGLOVO_PROFILE"
+PROFILE_MEMORY_ENV = "ROBOGLOVO_PROFILE_MEMORY"
+
+
+def code_key(function):
+    code = function.__code__
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class Profiler:
+    """
+    cProfile around a main loop, optionally with tracemalloc. step() is
+    called once per tick (or received batch); the profile is dumped every
+    `every` steps, on SIGUSR1 and by stop(). Each dump covers the time since
+    the previous one and goes to <directory>/<name>-<n>.prof (for pstats or
+    snakeviz), with a readable summary next to it in <name>-<n>.txt.
+
+    components maps a label to the functions whose cumulative time is
+    reported under it, or to a module whose own time (everything it runs
+    itself, not what it calls back) is summed, e.g. a library like
+    statemachine.
+    """
+
+    def __init__(self, name, directory="profiles", every=0, memory=False, components=None):
+        self.name = name
+        self.directory = directory
+        self.every = every
+        self.memory = memory
+        self.components = components or {}
+        self.profile = None
+        self.steps = 0
+        self.dumps = 0
+        self.requested = False
+        self.memory_snapshot = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.memory:
+            tracemalloc.start()
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self.request_dump)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        print(f"Profiling {self.name} into {self.directory}, send SIGUSR1 to pid {os.getpid()} to dump.")
+
+    def request_dump(self, signum=None, frame=None):
+        # Only a flag: the dump happens in the loop, between two steps
+        self.requested = True
+
+    def step(self):
+        self.steps += 1
+        if self.requested or (self.every and self.steps % self.every == 0):
+            self.requested = False
+            self.dump()
+
+    def stop(self):
+        self.dump()
+        self.profile = None
+        if self.memory:
+            tracemalloc.stop()
+
+    def dump(self):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        self.dumps += 1
+        path = os.path.join(self.directory, f"{self.name}-{self.dumps:03}")
+        stats = pstats.Stats(self.profile)
+        stats.dump_stats(path + ".prof")
+        with open(path + ".txt", "w", encoding="utf-8") as f:
+            f.write(f"{self.name}: {self.steps} steps, dumped {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+            f.write(self.component_report(stats))
+            f.write("\n")
+            text = io.StringIO()
+            pstats.Stats(self.profile, stream=text).sort_stats("cumulative").print_stats(30)
+            f.write(text.getvalue())
+            if self.memory:
+                f.write(self.memory_report())
+        # The next dump covers only what happens from here on
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def component_report(self, stats):
+        total = stats.total_tt or 1.0
+        lines = [f"{'component':24} {'seconds':>9} {'share':>7}"]
+        for label, target in self.components.items():
+            if hasattr(target, "__file__"):
+                # Own time of everything in the module, or the package's directory
+                prefix = os.path.dirname(target.__file__) if target.__file__.endswith("__init__.py") else target.__file__
+                seconds = sum(entry[2] for key, entry in stats.stats.items() if key[0].startswith(prefix))
+            else:
+                keys = [code_key(function) for function in target]
+                seconds = sum(stats.stats[key][3] for key in keys if key in stats.stats)
+            lines.append(f"{label:24} {seconds:9.3f} {100 * seconds / total:6.1f}%")
+        lines.append(f"{'total':24} {total:9.3f}")
+        return "\n".join(lines) + "\n"
+
+    def memory_report(self):
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"\ntracemalloc: {current / 1024:.0f} KiB traced, peak {peak / 1024:.0f} KiB", "top allocations:"]
+        lines += [f"  {stat}" for stat in snapshot.statistics("lineno")[:15]]
+        if self.memory_snapshot is not None:
+            lines.append("growth since the previous dump:")
+            lines += [f"  {stat}" for stat in snapshot.compare_to(self.memory_snapshot, "lineno")[:15]]
+        self.memory_snapshot = snapshot
+        return "\n".join(lines) + "\n"
+
+
+def profiler_from_config(config, name, components=None):
+    """
+    A started Profiler if config "profile" or the ROBOGLOVO_PROFILE
+    environment variable asks for one, None otherwise.
+    """
+    if not (config.get("profile", False) or os.environ.get(PROFILE_ENV, "0") != "0"):
+        return None
+    profiler = Profiler(
+        name,
+        directory=config.get("profile_dir", "profiles"),
+        every=config.get("profile_every", 0),
+        memory=config.get("profile_memory", False) or os.environ.get(PROFILE_MEMORY_ENV, "0") != "0",
+        components=components,
+    )
+    profiler.start()
+    return profiler
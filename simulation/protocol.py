@@ -0,0 +1,334 @@
+import json
+import select
+import struct
+import time
+from enum import Enum
+
+
+# Event Types
+class EventType(Enum):
+    NEW_ORDER = "new_order"
+    SPAWN_COURIER = "robot_spawn"
+    ID_OF_SPAWNED_ROBOT = "id_of_spawned_robot"
+    RETURN_TO_BASE = "robot_return"
+    ARRIVED_AT_BASE = "robot_returned"
+    LOW_BATTERY_WARNING = "battery_low"
+    BATTERY_DEPLETED = "battery_dead"
+    ARRIVED_AT_RESTAURANT = "robot_arrived"
+    ROBOT_PICK_FOOD = "robot_pick"
+    FOOD_PICKED_UP = "food_picked"
+    FOOD_READY = "food_ready"
+    DELIVER_FOOD = "robot_deliver"
+    FOOD_DELIVERED = "food_delivered"
+    BACKPACK_EMPTIED = "robot_empty"  # "plecak_skurwiela_oprozniony"
+    FOOD_START = "food_start"
+
+
+# Every message on the wire is prefixed with its payload length, so the
+# receiving side can split a TCP stream back into whole messages no matter
+# how the kernel coalesced or fragmented them.
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+RECV_CHUNK = 65536
+
+
+class FramingError(ConnectionError):
+    """The stream can no longer be split into frames, the connection is lost."""
+
+
+def encode_frame(payload: bytes) -> bytes:
+    """Prefix payload with its length."""
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {len(payload)} bytes exceeds {MAX_FRAME_SIZE}")
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """
+    Persistent receive buffer. Bytes are fed in as they arrive from the
+    socket; every complete frame is returned, partial ones are kept until
+    the rest of them shows up. A length over MAX_FRAME_SIZE means the
+    stream is out of step: there is no telling where the next frame
+    starts, so the buffer is dropped and FramingError raised once.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[bytes]:
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer, offset)
+            if length > MAX_FRAME_SIZE:
+                self.buffer.clear()
+                raise FramingError(f"Frame of {length} bytes exceeds {MAX_FRAME_SIZE}, stream lost")
+            end = offset + HEADER.size + length
+            if end > len(self.buffer):
+                break
+            frames.append(bytes(self.buffer[offset + HEADER.size:end]))
+            offset = end
+        if offset:
+            del self.buffer[:offset]
+        return frames
+
+    def pending(self) -> int:
+        return len(self.buffer)
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, data_) -> bytes:
+        return json.dumps(data_).encode("utf-8")
+
+    def decode(self, payload: bytes):
+        return json.loads(payload.decode("utf-8"))
+
+
+# How a field's values are laid out in the struct
+SCALAR, PAIR, FOOD = "scalar", "pair", "food"
+
+
+def food_size(food):
+    if not isinstance(food, dict) or list(food) != ["size"]:
+        raise ValueError(food)
+    return food["size"]
+
+
+class BinaryCodec:
+    """
+    Compact encoding of event lists. Each event is one byte with its
+    EventType code, one byte with a mask of present fields and the packed
+    field values. Events that do not fit the schema (unknown id or keys,
+    values out of range) are escaped as embedded JSON, so nothing is lost.
+
+    The struct and the fields it holds are looked up once per key set
+    (encoding) or mask (decoding) and cached, so the per-event cost is a
+    single struct call and a loop over a few fields.
+    """
+    name = "binary"
+
+    # (key, struct format) in wire order; bit i of the mask is FIELDS[i]
+    FIELDS = (
+        ("robot_number", "i"),
+        ("order_number", "i"),
+        ("food", "B"),
+        ("restaurant", "hh"),
+        ("address", "hh"),
+        ("battery_range", "i"),
+    )
+    ALL_FIELDS = (1 << len(FIELDS)) - 1
+    EVENT_CODES = {event_type.value: code for code, event_type in enumerate(EventType)}
+    EVENT_IDS = [event_type.value for event_type in EventType]
+    ESCAPE = 0xFF
+    EVENT_HEADER = struct.Struct("!BB")
+    ESCAPE_HEADER = struct.Struct("!BI")
+
+    def __init__(self):
+        self.field_bits = {key: 1 << bit for bit, (key, _) in enumerate(self.FIELDS)}
+        self.encoders = {}  # (id, keys) -> (code, mask, struct, fields) or None
+        self.decoders = {}  # mask -> (struct, fields)
+
+    def fields_of(self, mask, prefix=""):
+        """
+        Struct for prefix and the values of the fields in mask, and those
+        fields in wire order as (key, kind, index of their first value).
+        """
+        fields = []
+        fmt = prefix
+        index = 0
+        for bit, (key, key_fmt) in enumerate(self.FIELDS):
+            if mask & (1 << bit):
+                kind = FOOD if key == "food" else PAIR if len(key_fmt) == 2 else SCALAR
+                fields.append((key, kind, index))
+                fmt += key_fmt
+                index += len(key_fmt)
+        return struct.Struct("!" + fmt), fields
+
+    def make_encoder(self, event_id, keys):
+        """Code, mask, struct and fields for events with the given id and keys, None if they must be escaped."""
+        if event_id not in self.EVENT_CODES or keys[0] != "id" or len(set(keys)) != len(keys):
+            return None
+        if any(key not in self.field_bits for key in keys[1:]):
+            return None
+        mask = sum(self.field_bits[key] for key in keys[1:])
+        # The event header goes into the same struct, one pack call per event
+        packer, fields = self.fields_of(mask, "BB")
+        return self.EVENT_CODES[event_id], mask, packer, fields
+
+    def pack_event(self, encoder, event):
+        code, mask, packer, fields = encoder
+        values = [code, mask]
+        for key, kind, _ in fields:
+            value = event[key]
+            if kind is SCALAR:
+                values.append(value)
+            elif kind is PAIR:
+                if len(value) != 2:
+                    raise ValueError(value)
+                values += value
+            else:
+                values.append(food_size(value))
+        return packer.pack(*values)
+
+    def unpack_event(self, event_id, decoder, payload, offset):
+        unpacker, fields = decoder
+        values = unpacker.unpack_from(payload, offset)
+        event = {"id": event_id}
+        for key, kind, index in fields:
+            if kind is SCALAR:
+                event[key] = values[index]
+            elif kind is PAIR:
+                event[key] = [values[index], values[index + 1]]
+            else:
+                event[key] = {"size": values[index]}
+        return event
+
+    def encode_event(self, event: dict) -> bytes:
+        keys = tuple(event)
+        cache_key = (event.get("id"), keys)
+        if cache_key not in self.encoders:
+            self.encoders[cache_key] = self.make_encoder(*cache_key)
+        encoder = self.encoders[cache_key]
+        if encoder is not None:
+            try:
+                return self.pack_event(encoder, event)
+            except (ValueError, TypeError, IndexError, struct.error):
+                pass
+        payload = json.dumps(event).encode("utf-8")
+        return self.ESCAPE_HEADER.pack(self.ESCAPE, len(payload)) + payload
+
+    def encode(self, data_) -> bytes:
+        if isinstance(data_, dict):
+            data_ = [data_]
+        return b"".join([self.encode_event(event) for event in data_])
+
+    def decode(self, payload: bytes) -> list:
+        """Events in payload, ValueError if it is truncated or holds an unknown code or mask."""
+        try:
+            return self.decode_events(payload)
+        except (IndexError, struct.error, UnicodeDecodeError) as e:
+            raise ValueError(f"Malformed binary frame: {e}") from e
+
+    def decode_events(self, payload):
+        events = []
+        offset = 0
+        size = len(payload)
+        decoders = self.decoders
+        while offset < size:
+            code = payload[offset]
+            if code == self.ESCAPE:
+                _, length = self.ESCAPE_HEADER.unpack_from(payload, offset)
+                offset += self.ESCAPE_HEADER.size
+                if offset + length > size:
+                    raise ValueError(f"Escaped event of {length} bytes runs past the end of the frame")
+                events.append(json.loads(payload[offset:offset + length].decode("utf-8")))
+                offset += length
+                continue
+            if code >= len(self.EVENT_IDS):
+                raise ValueError(f"Unknown event code {code}")
+            mask = payload[offset + 1]
+            if mask & ~self.ALL_FIELDS:
+                raise ValueError(f"Unknown field mask {mask:#04x}")
+            offset += self.EVENT_HEADER.size
+            if mask not in decoders:
+                decoders[mask] = self.fields_of(mask)
+            events.append(self.unpack_event(self.EVENT_IDS[code], decoders[mask], payload, offset))
+            offset += decoders[mask][0].size
+        return events
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), BinaryCodec())}
+DEFAULT_CODEC = CODECS["json"]
+
+
+def encode_message(data_, codec=DEFAULT_CODEC) -> bytes:
+    return encode_frame(codec.encode(data_))
+
+
+def decode_messages(frames: list[bytes], codec=DEFAULT_CODEC) -> list:
+    """
+    Decode frames into a flat list of events. Both sides send lists of
+    events, anything else is passed through as a single item. A frame that
+    cannot be decoded is reported and skipped, the others still count.
+    """
+    events = []
+    for frame in frames:
+        try:
+            message = codec.decode(frame)
+        except ValueError as e:
+            print(f"Error: dropping malformed {codec.name} frame of {len(frame)} bytes: {e}")
+            continue
+        if isinstance(message, list):
+            events.extend(message)
+        else:
+            events.append(message)
+    return events
+
+
+# Handshake: right after connecting the supervisor offers the wire formats
+# it supports in order of preference, the simulation answers with the one
+# both sides will use. Handshake frames are always JSON.
+def make_hello(wire_format: str) -> bytes:
+    offered = [wire_format] if wire_format != DEFAULT_CODEC.name else []
+    return encode_message({"hello": offered + [DEFAULT_CODEC.name]})
+
+
+def choose_codec(hello: dict, wire_format: str):
+    """Pick the codec for a connection from the client's hello."""
+    offered = hello.get("hello", [DEFAULT_CODEC.name])
+    if wire_format in offered and wire_format in CODECS:
+        return CODECS[wire_format]
+    return DEFAULT_CODEC
+
+
+def read_frame_blocking(sock, decoder: FrameDecoder, timeout=10.0) -> bytes:
+    """Wait for a single frame, used only during the handshake."""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        ready_to_read, _, _ = select.select([sock], [], [], max(remaining, 0))
+        if not ready_to_read:
+            raise TimeoutError("Handshake timed out")
+        data, closed = recv_available(sock)
+        frames = decoder.feed(data)
+        if frames:
+            # Anything that arrived after the handshake frame stays buffered
+            decoder.buffer[:0] = b"".join(encode_frame(frame) for frame in frames[1:])
+            return frames[0]
+        if closed:
+            raise ConnectionError("Peer closed during handshake")
+
+
+def recv_available(sock) -> tuple[bytes, bool]:
+    """
+    Drain everything currently readable from a non-blocking socket.
+    Returns the data and a flag telling whether the peer closed the connection.
+    """
+    chunks = []
+    while True:
+        try:
+            chunk = sock.recv(RECV_CHUNK)
+        except (BlockingIOError, InterruptedError):
+            return b"".join(chunks), False
+        if not chunk:
+            return b"".join(chunks), True
+        chunks.append(chunk)
+
+
+def send_all(sock, data: bytes, timeout=5.0):
+    """
+    sendall() for non-blocking sockets. A frame must never be cut in half,
+    so wait for the socket to become writable instead of dropping the rest.
+    """
+    view = memoryview(data)
+    while view:
+        try:
+            sent = sock.send(view)
+            view = view[sent:]
+        except (BlockingIOError, InterruptedError):
+            _, ready_to_write, _ = select.select([], [sock], [], timeout)
+            if not ready_to_write:
+                raise TimeoutError("Peer is not reading, send buffer full")
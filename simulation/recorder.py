@@ -0,0 +1,41 @@
+import json
+from collections import defaultdict
+
+# Direction of a recorded event, seen from the simulation
+TO_SUPERVISOR = "out"
+FROM_SUPERVISOR = "in"
+
+
+class EventRecorder:
+    """
+    Saves every event exchanged with the supervisor as one JSON line
+    with the tick it belongs to. The first line holds the run's config.
+    """
+
+    def __init__(self, path, config):
+        self.file = open(path, "w", encoding="utf-8")
+        self.file.write(json.dumps({"config": config}) + "\n")
+
+    def record(self, tick, direction, events):
+        for event in events:
+            self.file.write(json.dumps({"tick": tick, "dir": direction, "event": event}) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def load_recording(path):
+    """
+    Returns the recorded config and, for every tick, the events sent to and
+    received from the supervisor: {tick: {TO_SUPERVISOR: [...], FROM_SUPERVISOR: [...]}}
+    """
+    config = {}
+    ticks = defaultdict(lambda: {TO_SUPERVISOR: [], FROM_SUPERVISOR: []})
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if "config" in entry:
+                config = entry["config"]
+                continue
+            ticks[entry["tick"]][entry["dir"]].append(entry["event"])
+    return config, dict(sorted(ticks.items()))
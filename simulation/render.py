@@ -1,15 +1,19 @@
-import random
+import itertools
 
 import pygame
 
+BACKGROUND = (30, 30, 30)
+LOW_BATTERY_EYES = (255, 0, 0)
+CARRYING_FOOD = (255, 140, 0)
+
 
 class Renderer:
-    def __init__(self, city_size, cell_size, num_restaurants):
+    def __init__(self, city_size, cell_size, buildings, road_spacing=3):
         pygame.init()
 
         self.city_size = city_size  # Size of the city grid (number of tiles)
         self.cell_size = cell_size  # Size of each tile in pixels
-        self.num_restaurants = num_restaurants  # Number of restaurants
+        self.road_spacing = road_spacing  # Every road_spacing-th column and row is a road
 
         # Screen setup
         self.screen = pygame.display.set_mode(
@@ -17,84 +21,57 @@ class Renderer:
         )
         pygame.display.set_caption("RoboGlovo")
 
-        # Generate buildings and roads
-        self.buildings = self.generate_buildings()
-
-    def generate_buildings(self):
-        """
-        Generate buildings, restaurants, and main roads in the city.
-        """
-        buildings = {}
-        available_positions = [
-            (x, y)
-            for x in range(self.city_size[0])
-            for y in range(self.city_size[1])
-        ]
-
-        # Base
-        base_position = (0, 0)
-        buildings = {base_position: "robot_base"}
-        available_positions.remove(base_position)
-
-        # Roads
-        road_spacing = 3
-        road_positions = [
-            (x, y)
-            for x in range(self.city_size[0])
-            for y in range(self.city_size[1])
-            if x % road_spacing == 0 or y % road_spacing == 0
-        ]
-        for x, y in road_positions:
-            if (x, y) != base_position:
-                buildings[(x, y)] = "road"
-
-
-        # Restaurants
-        restaurant_positions = random.sample(
-            [pos for pos in available_positions if pos not in road_positions],
-            self.num_restaurants
-        )
-        for x, y in restaurant_positions:
-            buildings[(x, y)] = "restaurant"
-
-
-        # Rest of the buildings
-        for x, y in available_positions:
-            if (x, y) not in buildings:
-                buildings[(x, y)] = random.choice(
-                    ["house", "block", "skyscraper", "shop"]
-                )
-        return buildings
-
-    def get_restaurants(self):
-        """
-        Returns a list of coordinates where restaurants are located.
-        """
-        restaurants_list = []
-        for position, building_type in self.buildings.items():
-            if building_type == "restaurant":
-                restaurants_list.append(position)
-        return restaurants_list
+        # Buildings and roads, generated by city.generate_buildings
+        self.buildings = buildings
+
+        # SysFont looks the font up on the system every time, so only once here
+        self.base_font = pygame.font.SysFont("Arial", cell_size // 4, bold=True)
+        self.restaurant_font = pygame.font.SysFont("Arial", cell_size // 3, bold=True)
+
+        # One tile per building type (and road layout), drawn the first time it is needed
+        self.building_sprites = {}
+
+        # Robots in every size and state, (small, carrying, low_battery) -> sprite,
+        # so drawing a robot is one blit
+        self.robot_sprites = {}
+        for small, carrying, low_battery in itertools.product((False, True), repeat=3):
+            sprite = pygame.Surface((cell_size, cell_size), pygame.SRCALPHA).convert_alpha()
+            draw = self.draw_small_robot if small else self.draw_robot
+            draw(sprite, carrying, low_battery)
+            self.robot_sprites[(small, carrying, low_battery)] = sprite
+
+        # Robots drawn on every tile in the last frame, see tile_contents
+        self.tiles = {}
+        self.full_redraw = True
+        self.screen_size = self.screen.get_size()
+
+        # The city does not change after generate_buildings: it is drawn once
+        # to this surface and frames are restored from it
+        self.city_layer = pygame.Surface(self.screen.get_size()).convert()
+        self.city_layer.fill(BACKGROUND)
+        self.draw_grid()
 
-    def draw_road(self, x, y):
+    def draw_road(self, surface, x, y):
         """
         Draws a road with dashed lines separating lanes and crosswalks at intersections.
+        x and y only choose which of them the tile gets, it is drawn at the
+        top left corner of surface.
         """
-        base_x = x * self.cell_size
-        base_y = y * self.cell_size
+        base_x = 0
+        base_y = 0
 
         # Road background
         pygame.draw.rect(
-            self.screen,
+            surface,
             (60, 60, 60),  # Dark gray for the road
             pygame.Rect(base_x, base_y, self.cell_size, self.cell_size),
         )
 
         # Dashed centerline for horizontal roads
-        if x % 3 != 0:
+        if x % self.road_spacing != 0:
             for i in range(0, self.cell_size, self.cell_size // 8):
                 pygame.draw.line(
-                    self.screen,
+                    surface,
                     (255, 255, 255),  # White dashed line
                     (base_x + i, base_y + self.cell_size // 2),
                     (base_x + i + self.cell_size // 16, base_y + self.cell_size // 2),
@@ -102,10 +79,10 @@ class Renderer:
                 )
 
         # Dashed centerline for vertical roads
-        if y % 3 != 0:
+        if y % self.road_spacing != 0:
             for i in range(0, self.cell_size, self.cell_size // 8):
                 pygame.draw.line(
-                    self.screen,
+                    surface,
                     (255, 255, 255),  # White dashed line
                     (base_x + self.cell_size // 2, base_y + i),
                     (base_x + self.cell_size // 2, base_y + i + self.cell_size // 16),
@@ -114,12 +91,12 @@ class Renderer:
 
         # Crosswalk at intersections
         if (
-            x % 3 == 0
-            and y % 3 == 0
+            x % self.road_spacing == 0
+            and y % self.road_spacing == 0
         ):
             for i in range(0, self.cell_size, self.cell_size // 8):
                 pygame.draw.line(
-                    self.screen,
+                    surface,
                     (255, 255, 255),  # White dashed line
                     (base_x + self.cell_size // 2, base_y + i),
                     (base_x + self.cell_size // 2, base_y + i + self.cell_size // 16),
@@ -127,22 +104,22 @@ class Renderer:
                 )
             for i in range(0, self.cell_size, self.cell_size // 8):
                 pygame.draw.line(
-                    self.screen,
+                    surface,
                     (255, 255, 255),  # White dashed line
                     (base_x + i, base_y + self.cell_size // 2),
                     (base_x + i + self.cell_size // 16, base_y + self.cell_size // 2),
                     2,
                 )
 
-    def draw_building(self, x, y, building_type):
+    def draw_building(self, surface, x, y, building_type):
         """
-        Draws a building or road based on its type.
+        Draws a building or road based on its type, at the top left corner of surface.
         """
-        base_x = x * self.cell_size
-        base_y = y * self.cell_size
+        base_x = 0
+        base_y = 0
 
         if building_type == "road":
-            self.draw_road(x, y)
+            self.draw_road(surface, x, y)
 
         if building_type == "house":
             # Adjusted house to avoid overlapping roads
@@ -152,11 +129,11 @@ class Renderer:
                 self.cell_size // 2,
                 self.cell_size // 3,
             )
-            pygame.draw.rect(self.screen, (150, 75, 0), rect)  # Brown base
+            pygame.draw.rect(surface, (150, 75, 0), rect)  # Brown base
 
             # Roof
             pygame.draw.polygon(
-                self.screen,
+                surface,
                 (200, 50, 50),  # Red roof
                 [
                     (base_x + self.cell_size // 4, base_y + self.cell_size // 2 + self.cell_size // 6),
@@ -172,9 +149,9 @@ class Renderer:
                 self.cell_size // 6,
                 self.cell_size // 4,
             )
-            pygame.draw.rect(self.screen, (100, 50, 0), door)
+            pygame.draw.rect(surface, (100, 50, 0), door)
             pygame.draw.circle(
-                self.screen, (255, 255, 0), (door.left + 3, door.centery), 1
+                surface, (255, 255, 0), (door.left + 3, door.centery), 1
             )  # Door handle
 
             # Window
@@ -184,12 +161,12 @@ class Renderer:
                 self.cell_size // 6,
                 self.cell_size // 6,
             )
-            pygame.draw.rect(self.screen, (50, 190, 255), window)
+            pygame.draw.rect(surface, (50, 190, 255), window)
             pygame.draw.line(
-                self.screen, (0, 0, 0), window.midtop, window.midbottom, 1
+                surface, (0, 0, 0), window.midtop, window.midbottom, 1
             )  # Vertical divider
             pygame.draw.line(
-                self.screen, (0, 0, 0), window.midleft, window.midright, 1
+                surface, (0, 0, 0), window.midleft, window.midright, 1
             )  # Horizontal divider
 
         elif building_type == "block":
@@ -200,7 +177,7 @@ class Renderer:
                 3 * self.cell_size // 4,
                 2 * self.cell_size // 3,
             )
-            pygame.draw.rect(self.screen, (100, 100, 100), rect)  # Gray base
+            pygame.draw.rect(surface, (100, 100, 100), rect)  # Gray base
 
             # Windows grid
             for i in range(3):
@@ -212,23 +189,20 @@ class Renderer:
                         self.cell_size // 10,
                     )
                     pygame.draw.rect(
-                        self.screen,
+                        surface,
                         (255, 255, 0) if (i + j) % 2 == 0 else (50, 190, 255),
                         window,
                     )
 
         elif building_type == "robot_base":
             # Baza robotów – wyśrodkowany kwadrat
-            base_x = x * self.cell_size
-            base_y = y * self.cell_size
             pygame.draw.rect(
-                self.screen,
+                surface,
                 (0, 150, 0),  # Zielony kolor bazy
                 pygame.Rect(base_x, base_y, self.cell_size, self.cell_size)
             )
-            font = pygame.font.SysFont("Arial", self.cell_size // 4, bold=True)
-            text = font.render("BASE", True, (255, 255, 255))
-            self.screen.blit(
+            text = self.base_font.render("BASE", True, (255, 255, 255))
+            surface.blit(
                 text,
                 (base_x + self.cell_size // 4, base_y + self.cell_size // 3),
             )
@@ -243,7 +217,7 @@ class Renderer:
                 3 * self.cell_size // 4,
                 self.cell_size // 2,
             )
-            pygame.draw.rect(self.screen, (255, 0, 0), rect)  # Czerwona podstawa
+            pygame.draw.rect(surface, (255, 0, 0), rect)  # Czerwona podstawa
 
             # Żółty dach
             roof = pygame.Rect(
@@ -252,12 +226,11 @@ class Renderer:
                 rect.width,
                 self.cell_size // 18,
             )
-            pygame.draw.rect(self.screen, (255, 255, 0), roof)  # Żółty dach
+            pygame.draw.rect(surface, (255, 255, 0), roof)  # Żółty dach
 
             # Duża żółta litera "M" na dachu
-            font = pygame.font.SysFont("Arial", self.cell_size // 3, bold=True)
-            text = font.render("M", True, (255, 255, 0))  # Żółta litera
-            self.screen.blit(
+            text = self.restaurant_font.render("M", True, (255, 255, 0))  # Żółta litera
+            surface.blit(
                 text,
                 (
                     roof.centerx - text.get_width() // 2,
@@ -273,7 +246,7 @@ class Renderer:
                     rect.width // 4,
                     rect.height // 3,
                 )
-                pygame.draw.rect(self.screen, (150, 220, 255), window)  # Jasnoniebieskie szkło
+                pygame.draw.rect(surface, (150, 220, 255), window)  # Jasnoniebieskie szkło
 
             # Opcjonalne stoliki przed restauracją
             for i in range(3):  # Trzy stoliki
@@ -283,9 +256,9 @@ class Renderer:
                     self.cell_size // 8,
                     self.cell_size // 12,
                 )
-                pygame.draw.ellipse(self.screen, (255, 255, 255), table)  # Biały stolik
+                pygame.draw.ellipse(surface, (255, 255, 255), table)  # Biały stolik
                 pygame.draw.line(
-                    self.screen,
+                    surface,
                     (150, 150, 150),
                     (table.centerx, table.bottom),
                     (table.centerx, table.bottom + self.cell_size // 16),
@@ -301,7 +274,7 @@ class Renderer:
                 self.cell_size // 3,          # Węższy wieżowiec
                 self.cell_size // 2,          # Niższy wieżowiec
             )
-            pygame.draw.rect(self.screen, (50, 50, 150), rect)  # Niebieska podstawa
+            pygame.draw.rect(surface, (50, 50, 150), rect)  # Niebieska podstawa
 
             # Siatka wycentrowanych okien na elewacji
             window_width = self.cell_size // 12
@@ -317,7 +290,7 @@ class Renderer:
                         window_width,
                         window_height,
                     )
-                    pygame.draw.rect(self.screen, (200, 200, 255), window)
+                    pygame.draw.rect(surface, (200, 200, 255), window)
 
             # Dekoracyjny dach na górze
             roof = pygame.Rect(
@@ -326,18 +299,18 @@ class Renderer:
                 rect.width * 2 // 3,
                 self.cell_size // 16,
             )
-            pygame.draw.rect(self.screen, (70, 70, 200), roof)  # Ciemniejszy dach
+            pygame.draw.rect(surface, (70, 70, 200), roof)  # Ciemniejszy dach
 
             # Antena na dachu
             pygame.draw.line(
-                self.screen,
+                surface,
                 (255, 255, 255),
                 (roof.centerx, roof.top),
                 (roof.centerx, roof.top - self.cell_size // 8),
                 1,
             )
             pygame.draw.circle(
-                self.screen,
+                surface,
                 (255, 0, 0),
                 (roof.centerx, roof.top - self.cell_size // 8),
                 1,
@@ -353,7 +326,7 @@ class Renderer:
                 3 * self.cell_size // 4,
                 self.cell_size // 2,
             )
-            pygame.draw.rect(self.screen, (100, 200, 100), rect)  # Zielona podstawa
+            pygame.draw.rect(surface, (100, 200, 100), rect)  # Zielona podstawa
             
             # Drzwi wejściowe
             door = pygame.Rect(
@@ -362,9 +335,9 @@ class Renderer:
                 self.cell_size // 6,
                 self.cell_size // 6,
             )
-            pygame.draw.rect(self.screen, (80, 80, 80), door)  # Szare drzwi
+            pygame.draw.rect(surface, (80, 80, 80), door)  # Szare drzwi
             pygame.draw.line(
-                self.screen,
+                surface,
                 (200, 200, 200),
                 (door.left, door.centery),
                 (door.right, door.centery),
@@ -379,7 +352,7 @@ class Renderer:
                     self.cell_size // 6,
                     self.cell_size // 5,
                 )
-                pygame.draw.rect(self.screen, (150, 220, 255), window)  # Błękitne witryny
+                pygame.draw.rect(surface, (150, 220, 255), window)  # Błękitne witryny
             
             # Żółty szyld nad wejściem
             sign = pygame.Rect(
@@ -388,9 +361,9 @@ class Renderer:
                 self.cell_size // 2,
                 self.cell_size // 8,
             )
-            pygame.draw.rect(self.screen, (255, 255, 0), sign)  # Żółty prostokąt
+            pygame.draw.rect(surface, (255, 255, 0), sign)  # Żółty prostokąt
             pygame.draw.rect(
-                self.screen,
+                surface,
                 (0, 0, 0),
                 sign.inflate(-4, -4),
                 2,
@@ -403,191 +376,265 @@ class Renderer:
                 self.cell_size // 6,
                 self.cell_size // 6,
             )
-            pygame.draw.ellipse(self.screen, (200, 50, 50), logo_circle)  # Czerwone koło
+            pygame.draw.ellipse(surface, (200, 50, 50), logo_circle)  # Czerwone koło
             pygame.draw.rect(
-                self.screen,
+                surface,
                 (255, 255, 255),
                 logo_circle.inflate(-self.cell_size // 12, -self.cell_size // 12),
             )  # Białe wypełnienie w środku
 
+    def building_sprite(self, x, y, building_type):
+        if building_type == "road":
+            key = (building_type, x % self.road_spacing != 0, y % self.road_spacing != 0)
+        else:
+            key = (building_type,)
+        sprite = self.building_sprites.get(key)
+        if sprite is None:
+            sprite = pygame.Surface((self.cell_size, self.cell_size)).convert()
+            sprite.fill(BACKGROUND)
+            self.draw_building(sprite, x, y, building_type)
+            self.building_sprites[key] = sprite
+        return sprite
+
     def draw_grid(self):
         """
-        Draw roads first, then buildings.
+        Draw roads first, then buildings, onto the city layer.
         """
         # Draw roads first
         for (x, y), building_type in self.buildings.items():
             if building_type == "road":
-                self.draw_road(x, y)
+                self.city_layer.blit(self.building_sprite(x, y, building_type), (x * self.cell_size, y * self.cell_size))
 
         # Draw buildings on top of roads
         for (x, y), building_type in self.buildings.items():
             if building_type != "road":
-                self.draw_building(x, y, building_type)
+                self.city_layer.blit(self.building_sprite(x, y, building_type), (x * self.cell_size, y * self.cell_size))
 
-    def draw_robots(self, robots):
+    def draw_small_robot(self, surface, carrying, low_battery):
         """
-        Draws robots on the map. If multiple robots are on the same tile, they are stacked.
+        Draws a robot as it looks when it shares its tile with others, in the
+        middle of surface.
         """
-        # Group robots by their position
-        robot_positions = {}
-        for robot in robots:
-            position = (robot.x, robot.y)
-            if position not in robot_positions:
-                robot_positions[position] = []
-            robot_positions[position].append(robot)
-
-        # Draw robots at each position
-        for position, robots_at_position in robot_positions.items():
-            center_x = int(position[0] * self.cell_size + self.cell_size // 2)
-            center_y = int(position[1] * self.cell_size + self.cell_size // 2)
-
-            # If there is more than one robot on this tile, draw them smaller
-            if len(robots_at_position) > 1:
-                num_robots = len(robots_at_position)
-                spacing = self.cell_size // (2 * num_robots)  # Adjust spacing based on the number of robots
-                for i, robot in enumerate(robots_at_position):
-                    offset_x = (i - (num_robots - 1) / 2) * spacing
-                    offset_y = (i - (num_robots - 1) / 2) * spacing
-
-                    # Smaller robot body
-                    body = pygame.Rect(
-                        center_x - self.cell_size // 12 + offset_x,
-                        center_y - self.cell_size // 12 + offset_y,
-                        self.cell_size // 6,
-                        self.cell_size // 6,
-                    )
-                    pygame.draw.rect(self.screen, (200, 200, 200), body, border_radius=3)  # Metallic body
+        center_x = self.cell_size // 2
+        center_y = self.cell_size // 2
+
+        # Smaller robot body
+        body = pygame.Rect(
+            center_x - self.cell_size // 12,
+            center_y - self.cell_size // 12,
+            self.cell_size // 6,
+            self.cell_size // 6,
+        )
+        # Metallic body, orange with food on board as there is no room for a backpack
+        pygame.draw.rect(surface, CARRYING_FOOD if carrying else (200, 200, 200), body, border_radius=3)
+
+        # Smaller head
+        head = pygame.Rect(
+            body.centerx - self.cell_size // 20,
+            body.top - self.cell_size // 12,
+            self.cell_size // 10,
+            self.cell_size // 10,
+        )
+        pygame.draw.rect(surface, (180, 180, 180), head, border_radius=2)  # Metallic head
+
+        # Smaller eyes
+        eye_radius = self.cell_size // 24
+        eye_color = LOW_BATTERY_EYES if low_battery else (0, 255, 0)
+        pygame.draw.circle(surface, eye_color, (head.centerx - eye_radius, head.centery), eye_radius)
+        pygame.draw.circle(surface, eye_color, (head.centerx + eye_radius, head.centery), eye_radius)
+
+        # Antenna
+        pygame.draw.line(
+            surface,
+            (255, 0, 0),
+            (head.centerx, head.top),
+            (head.centerx, head.top - self.cell_size // 12),
+            1,
+        )
+        pygame.draw.circle(
+            surface,
+            (255, 0, 0),
+            (head.centerx, head.top - self.cell_size // 12),
+            self.cell_size // 24,
+        )
 
-                    # Smaller head
-                    head = pygame.Rect(
-                        body.centerx - self.cell_size // 20,
-                        body.top - self.cell_size // 12,
-                        self.cell_size // 10,
-                        self.cell_size // 10,
-                    )
-                    pygame.draw.rect(self.screen, (180, 180, 180), head, border_radius=2)  # Metallic head
-
-                    # Smaller eyes
-                    eye_radius = self.cell_size // 24
-                    pygame.draw.circle(self.screen, (0, 255, 0), (head.centerx - eye_radius, head.centery), eye_radius)
-                    pygame.draw.circle(self.screen, (0, 255, 0), (head.centerx + eye_radius, head.centery), eye_radius)
-
-                    # Antenna
-                    pygame.draw.line(
-                        self.screen,
-                        (255, 0, 0),
-                        (head.centerx, head.top),
-                        (head.centerx, head.top - self.cell_size // 12),
-                        1,
-                    )
-                    pygame.draw.circle(
-                        self.screen,
-                        (255, 0, 0),
-                        (head.centerx, head.top - self.cell_size // 12),
-                        self.cell_size // 24,
-                    )
+        # Smaller wheels
+        wheel_radius = self.cell_size // 16
+        pygame.draw.circle(
+            surface,
+            (100, 100, 100),
+            (body.left + wheel_radius, body.bottom + wheel_radius),
+            wheel_radius,
+        )
+        pygame.draw.circle(
+            surface,
+            (100, 100, 100),
+            (body.right - wheel_radius, body.bottom + wheel_radius),
+            wheel_radius,
+        )
 
-                    # Smaller wheels
-                    wheel_radius = self.cell_size // 16
-                    pygame.draw.circle(
-                        self.screen,
-                        (100, 100, 100),
-                        (body.left + wheel_radius, body.bottom + wheel_radius),
-                        wheel_radius,
-                    )
-                    pygame.draw.circle(
-                        self.screen,
-                        (100, 100, 100),
-                        (body.right - wheel_radius, body.bottom + wheel_radius),
-                        wheel_radius,
-                    )
-            else:
-                # Draw a normal-sized robot
-                robot = robots_at_position[0]
-                # Body of the robot
-                body = pygame.Rect(
-                    center_x - self.cell_size // 6,
-                    center_y - self.cell_size // 6,
-                    self.cell_size // 3,
-                    self.cell_size // 3,
-                )
-                pygame.draw.rect(self.screen, (200, 200, 200), body, border_radius=5)  # Metallic body
+    def draw_robot(self, surface, carrying, low_battery):
+        """
+        Draws a normal-sized robot in the middle of surface.
+        """
+        center_x = self.cell_size // 2
+        center_y = self.cell_size // 2
+
+        # Body of the robot
+        body = pygame.Rect(
+            center_x - self.cell_size // 6,
+            center_y - self.cell_size // 6,
+            self.cell_size // 3,
+            self.cell_size // 3,
+        )
+        pygame.draw.rect(surface, (200, 200, 200), body, border_radius=5)  # Metallic body
+
+        # Head of the robot
+        head = pygame.Rect(
+            center_x - self.cell_size // 10,
+            center_y - self.cell_size // 4,
+            self.cell_size // 5,
+            self.cell_size // 5,
+        )
+        pygame.draw.rect(surface, (180, 180, 180), head, border_radius=3)  # Metallic head
+
+        # Eyes, red when the battery is low
+        eye_radius = self.cell_size // 20
+        eye_color = LOW_BATTERY_EYES if low_battery else (0, 255, 0)
+        pygame.draw.circle(surface, eye_color, (head.centerx - eye_radius, head.centery), eye_radius)  # Left eye
+        pygame.draw.circle(surface, eye_color, (head.centerx + eye_radius, head.centery), eye_radius)  # Right eye
+
+        # Antenna
+        pygame.draw.line(
+            surface,
+            (255, 0, 0),  # Red antenna
+            (head.centerx, head.top),
+            (head.centerx, head.top - self.cell_size // 8),
+            2,
+        )
+        pygame.draw.circle(
+            surface,
+            (255, 0, 0),
+            (head.centerx, head.top - self.cell_size // 8),
+            self.cell_size // 20,
+        )  # Antenna tip
+
+        # Backpack (for food delivery), orange when there is food in it
+        backpack = pygame.Rect(
+            center_x - self.cell_size // 8,
+            center_y + self.cell_size // 6,
+            self.cell_size // 4,
+            self.cell_size // 6,
+        )
+        pygame.draw.rect(surface, CARRYING_FOOD if carrying else (50, 50, 150), backpack)
+
+        # Arms
+        arm_length = self.cell_size // 6
+        pygame.draw.line(
+            surface,
+            (200, 200, 200),  # Metallic arms
+            (body.left, body.centery),
+            (body.left - arm_length, body.centery + arm_length // 2),
+            3,
+        )
+        pygame.draw.line(
+            surface,
+            (200, 200, 200),  # Metallic arms
+            (body.right, body.centery),
+            (body.right + arm_length, body.centery + arm_length // 2),
+            3,
+        )
 
-                # Head of the robot
-                head = pygame.Rect(
-                    center_x - self.cell_size // 10,
-                    center_y - self.cell_size // 4,
-                    self.cell_size // 5,
-                    self.cell_size // 5,
-                )
-                pygame.draw.rect(self.screen, (180, 180, 180), head, border_radius=3)  # Metallic head
+        # Wheels (below the body)
+        wheel_radius = self.cell_size // 12
+        pygame.draw.circle(
+            surface,
+            (100, 100, 100),
+            (body.left + wheel_radius, body.bottom + wheel_radius),
+            wheel_radius,
+        )
+        pygame.draw.circle(
+            surface,
+            (100, 100, 100),
+            (body.right - wheel_radius, body.bottom + wheel_radius),
+            wheel_radius,
+        )
 
-                # Eyes
-                eye_radius = self.cell_size // 20
-                pygame.draw.circle(self.screen, (0, 255, 0), (head.centerx - eye_radius, head.centery), eye_radius)  # Left eye
-                pygame.draw.circle(self.screen, (0, 255, 0), (head.centerx + eye_radius, head.centery), eye_radius)  # Right eye
+    def robot_sprite_key(self, robot, small):
+        return small, robot.current_capacity > 0, robot.has_low_battery()
 
-                # Antenna
-                pygame.draw.line(
-                    self.screen,
-                    (255, 0, 0),  # Red antenna
-                    (head.centerx, head.top),
-                    (head.centerx, head.top - self.cell_size // 8),
-                    2,
-                )
-                pygame.draw.circle(
-                    self.screen,
-                    (255, 0, 0),
-                    (head.centerx, head.top - self.cell_size // 8),
-                    self.cell_size // 20,
-                )  # Antenna tip
-
-                # Backpack (for food delivery)
-                backpack = pygame.Rect(
-                    center_x - self.cell_size // 8,
-                    center_y + self.cell_size // 6,
-                    self.cell_size // 4,
-                    self.cell_size // 6,
-                )
-                pygame.draw.rect(self.screen, (50, 50, 150), backpack)  # Blue backpack
+    def tile_contents(self, robots):
+        """
+        Robot sprites on every occupied tile, position -> keys into
+        robot_sprites in drawing order. Two frames with the same contents
+        on a tile look the same there.
+        """
+        # Group robots by their position
+        robot_positions = {}
+        for robot in robots:
+            robot_positions.setdefault((int(robot.x), int(robot.y)), []).append(robot)
 
-                # Arms
-                arm_length = self.cell_size // 6
-                pygame.draw.line(
-                    self.screen,
-                    (200, 200, 200),  # Metallic arms
-                    (body.left, body.centery),
-                    (body.left - arm_length, body.centery + arm_length // 2),
-                    3,
-                )
-                pygame.draw.line(
-                    self.screen,
-                    (200, 200, 200),  # Metallic arms
-                    (body.right, body.centery),
-                    (body.right + arm_length, body.centery + arm_length // 2),
-                    3,
-                )
+        # If there is more than one robot on a tile, they are drawn smaller
+        return {
+            position: tuple(self.robot_sprite_key(robot, len(robots_at_position) > 1) for robot in robots_at_position)
+            for position, robots_at_position in robot_positions.items()
+        }
 
-                # Wheels (below the body)
-                wheel_radius = self.cell_size // 12
-                pygame.draw.circle(
-                    self.screen,
-                    (100, 100, 100),
-                    (body.left + wheel_radius, body.bottom + wheel_radius),
-                    wheel_radius,
-                )
-                pygame.draw.circle(
-                    self.screen,
-                    (100, 100, 100),
-                    (body.right - wheel_radius, body.bottom + wheel_radius),
-                    wheel_radius,
-                )
+    def draw_tile(self, position, sprite_keys):
+        """
+        Draws the robots of one tile. If multiple robots are on the same tile, they are stacked.
+        """
+        left = position[0] * self.cell_size
+        top = position[1] * self.cell_size
+        if len(sprite_keys) > 1:
+            num_robots = len(sprite_keys)
+            spacing = self.cell_size // (2 * num_robots)  # Adjust spacing based on the number of robots
+            for i, key in enumerate(sprite_keys):
+                offset = int((i - (num_robots - 1) / 2) * spacing)
+                self.screen.blit(self.robot_sprites[key], (left + offset, top + offset))
+        else:
+            self.screen.blit(self.robot_sprites[sprite_keys[0]], (left, top))
+
+    def dirty_rect(self, position):
+        """
+        Screen area a tile's robots can cover: stacked sprites are shifted
+        by up to a quarter of a cell, so they reach into the neighbours.
+        """
+        rect = pygame.Rect(position[0] * self.cell_size, position[1] * self.cell_size, self.cell_size, self.cell_size)
+        return rect.inflate(self.cell_size // 2, self.cell_size // 2).clip(self.screen.get_rect())
+
+    def invalidate(self):
+        """Redraw the whole screen on the next update, e.g. after the window was resized or uncovered."""
+        self.full_redraw = True
 
     def update(self, robots):
         """
-        Updates the view with robots and buildings.
+        Updates the view with robots and buildings. After the first frame
+        only tiles whose robots changed are redrawn and sent to the display,
+        together with the parts of the neighbouring tiles they overlap.
         """
-        self.screen.fill((30, 30, 30))  # Background color
-        self.draw_grid()
-        self.draw_robots(robots)
-        pygame.display.flip()
+        tiles = self.tile_contents(robots)
+        if self.full_redraw or self.screen.get_size() != self.screen_size:
+            self.screen_size = self.screen.get_size()
+            self.screen.blit(self.city_layer, (0, 0))
+            for position, sprite_keys in tiles.items():
+                self.draw_tile(position, sprite_keys)
+            pygame.display.flip()
+            self.full_redraw = False
+        else:
+            changed = [position for position in tiles.keys() | self.tiles.keys()
+                       if tiles.get(position) != self.tiles.get(position)]
+            drawing_order = {position: i for i, position in enumerate(tiles)}
+            dirty = []
+            for x, y in changed:
+                rect = self.dirty_rect((x, y))
+                # Background and every robot reaching into rect, in the order a full frame draws them
+                nearby = [(x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if (x + dx, y + dy) in tiles]
+                self.screen.set_clip(rect)
+                self.screen.blit(self.city_layer, rect, rect)
+                for position in sorted(nearby, key=drawing_order.get):
+                    self.draw_tile(position, tiles[position])
+                dirty.append(rect)
+            self.screen.set_clip(None)
+            pygame.display.update(dirty)
+        self.tiles = tiles
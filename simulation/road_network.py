@@ -0,0 +1,125 @@
+import math
+from collections import deque
+
+import numpy as np
+
+# (dx, dy) of the four neighbours, in the order ties are broken when moving
+STEPS = np.array([(0, 1), (0, -1), (1, 0), (-1, 0)])
+
+
+class RoadNetwork:
+    """
+    Cells a robot can drive through: every column and row on the
+    road_spacing lattice, the same ones city.generate_buildings lays roads
+    on. A building is only entered as the end of a trip and left as the
+    start of one, never driven across.
+
+    For every target cell there is a NumPy array with the road distance
+    from each cell of the city and one with the direction of the first
+    step towards it. They are built with one BFS the first time the target
+    is asked for and kept, so afterwards both lookups are O(1). The base
+    and the restaurants are known up front and go through precompute at
+    startup, addresses are filled in as orders use them.
+
+    A building with no road next to it (the middle of a block wider than
+    two cells, or past the last road at the edge of the city) cannot be
+    reached at all. Its distance is infinite, see reachable and
+    nearest_reachable.
+    """
+
+    def __init__(self, city_size, road_spacing=3):
+        self.width, self.height = city_size
+        x, y = np.indices((self.width, self.height))
+        self.road = (x % road_spacing == 0) | (y % road_spacing == 0)
+        # Roads and the buildings next to one, the roads always form one connected lattice
+        padded = np.pad(self.road, 1, constant_values=False)
+        self.reachable = (self.road | padded[:-2, 1:-1] | padded[2:, 1:-1]
+                          | padded[1:-1, :-2] | padded[1:-1, 2:])
+        self.reachable_buildings = np.argwhere(self.reachable & ~self.road)
+        self.distances = {}  # target (x, y) -> distance array
+        self.steps = {}  # target (x, y) -> index into STEPS of the first move, -1 at the target
+
+    def precompute(self, targets):
+        for target in targets:
+            self.field(target)
+
+    def field(self, target):
+        target = (int(target[0]), int(target[1]))
+        if target not in self.distances:
+            self.distances[target] = self.bfs(target)
+            self.steps[target] = self.first_steps(target, self.distances[target])
+        return self.distances[target]
+
+    def bfs(self, target):
+        """Road distance from every cell to target, walking only on roads in between."""
+        distance = np.full((self.width, self.height), -1, dtype=np.int32)
+        distance[target] = 0
+        queue = deque([target])
+        while queue:
+            x, y = queue.popleft()
+            for dx, dy in STEPS.tolist():
+                nx, ny = x + dx, y + dy
+                if not (0 <= nx < self.width and 0 <= ny < self.height) or distance[nx, ny] >= 0:
+                    continue
+                # No driving from one building straight into the next one
+                if self.road[x, y] or self.road[nx, ny]:
+                    distance[nx, ny] = distance[x, y] + 1
+                    # Buildings get a distance but no path goes on through them
+                    if self.road[nx, ny]:
+                        queue.append((nx, ny))
+        return distance
+
+    def first_steps(self, target, distance):
+        """For every cell the neighbour one step closer to target, vectorized over the city."""
+        passable = self.road.copy()
+        passable[target] = True
+        padded_distance = np.pad(distance, 1, constant_values=-1)
+        padded_passable = np.pad(passable, 1, constant_values=False)
+        steps = np.full((self.width, self.height), -1, dtype=np.int8)
+        for index in reversed(range(len(STEPS))):
+            dx, dy = STEPS[index]
+            neighbour_distance = padded_distance[1 + dx:1 + dx + self.width, 1 + dy:1 + dy + self.height]
+            neighbour_passable = padded_passable[1 + dx:1 + dx + self.width, 1 + dy:1 + dy + self.height]
+            closer = neighbour_passable & (neighbour_distance == distance - 1) & (distance > 0)
+            steps[closer] = index
+        return steps
+
+    def nearest_reachable(self, cell):
+        """cell itself if it can be reached, otherwise the closest building that can."""
+        x, y = int(cell[0]), int(cell[1])
+        if self.reachable[x, y]:
+            return x, y
+        offsets = np.abs(self.reachable_buildings - (x, y)).sum(axis=1)
+        nx, ny = self.reachable_buildings[int(np.argmin(offsets))]
+        return int(nx), int(ny)
+
+    def distance(self, a, b):
+        """Road distance between cells a and b, math.inf if one cannot be reached from the other."""
+        a = (int(a[0]), int(a[1]))
+        b = (int(b[0]), int(b[1]))
+        # Distances are symmetric, use a table that is already there if possible
+        if b not in self.distances and a in self.distances:
+            a, b = b, a
+        distance = int(self.field(b)[a])
+        return distance if distance >= 0 else math.inf
+
+    def steps_to(self, target):
+        """Index into STEPS of the first move towards target from every cell, -1 at the target."""
+        self.field(target)
+        return self.steps[(int(target[0]), int(target[1]))]
+
+    def next_step(self, position, target):
+        """Cell to move to from position on the shortest road path to target, position if there is none."""
+        index = self.steps_to(target)[position[0], position[1]]
+        if index < 0:
+            return position[0], position[1]
+        dx, dy = STEPS[index]
+        return position[0] + int(dx), position[1] + int(dy)
+
+    def cost_matrix(self, sources, targets):
+        """Road distance from every source (rows) to every target (columns), np.inf where there is no path."""
+        targets = np.asarray(targets, dtype=int).reshape(-1, 2)
+        cost = np.array([self.field(source)[targets[:, 0], targets[:, 1]] for source in sources],
+                        dtype=float).reshape(len(sources), len(targets))
+        cost[cost < 0] = np.inf
+        return cost
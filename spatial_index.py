@@ -0,0 +1,88 @@
+import heapq
+from collections import defaultdict
+
+
+def manhattan(a, b):
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+
+class SpatialIndex:
+    """
+    Robots bucketed into square grid cells by their position. With cells the
+    size of the road spacing a nearest-robot query only looks at the few
+    cells around the point instead of at the whole fleet.
+    """
+
+    def __init__(self, cell_size=3):
+        self.cell_size = cell_size
+        self.cells = defaultdict(dict)  # (cx, cy) -> {robot id: robot}
+        self.cell_of = {}  # robot id -> (cx, cy)
+
+    def __len__(self):
+        return len(self.cell_of)
+
+    def __contains__(self, robot):
+        return robot.id in self.cell_of
+
+    def cell(self, position):
+        return (position[0] // self.cell_size, position[1] // self.cell_size)
+
+    def add(self, robot):
+        cell = self.cell(robot.position)
+        self.cells[cell][robot.id] = robot
+        self.cell_of[robot.id] = cell
+
+    def remove(self, robot):
+        cell = self.cell_of.pop(robot.id, None)
+        if cell is None:
+            return
+        del self.cells[cell][robot.id]
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def move(self, robot):
+        """Call after robot.position changed."""
+        cell = self.cell(robot.position)
+        if self.cell_of.get(robot.id) != cell:
+            self.remove(robot)
+            self.add(robot)
+
+    def ring(self, center, radius):
+        """Occupied cells at Chebyshev distance radius from center."""
+        cx, cy = center
+        if radius == 0:
+            if center in self.cells:
+                yield self.cells[center]
+            return
+        for dx in range(-radius, radius + 1):
+            for dy in (-radius, radius) if abs(dx) != radius else range(-radius, radius + 1):
+                cell = (cx + dx, cy + dy)
+                if cell in self.cells:
+                    yield self.cells[cell]
+
+    def nearest(self, point, k=1):
+        """
+        Up to k robots closest to point in Manhattan distance, closest first.
+        Ties go to the lowest robot id.
+        """
+        if not self.cell_of:
+            return []
+        center = self.cell(point)
+        best = []  # max-heap of (-distance, -id, robot), at most k long
+        seen = 0
+        radius = 0
+        while seen < len(self.cell_of):
+            for bucket in self.ring(center, radius):
+                for robot in bucket.values():
+                    seen += 1
+                    entry = (-manhattan(robot.position, point), -robot.id, robot)
+                    if len(best) < k:
+                        heapq.heappush(best, entry)
+                    elif entry[:2] > best[0][:2]:
+                        heapq.heapreplace(best, entry)
+            # Anything in ring radius + 1 is at least this far from the point
+            bound = radius * self.cell_size + 1
+            if len(best) == k and -best[0][0] < bound:
+                break
+            radius += 1
+        return [robot for _, _, robot in sorted(best, key=lambda entry: (-entry[0], -entry[1]))]
@@ -2,9 +2,29 @@ import socket
 import json
 import time
 import select
+import selectors
 import sys
+import math
+from collections import OrderedDict, defaultdict
+import statemachine
 from statemachine import StateMachine, State
 import numpy as np
+from assignment import SOLVERS
+from route_planner import DistanceTable, Job, plan_route, route_length
+from spatial_index import SpatialIndex
+from simulation.protocol import (CODECS, DEFAULT_CODEC, BinaryCodec, FrameDecoder, FramingError, JsonCodec,
+                                 decode_messages, encode_message, make_hello, read_frame_blocking, recv_available,
+                                 send_all)
+from simulation.eventlog import EventLog
+from simulation.metrics import Histogram, Metrics, metrics_from_config
+from simulation.profiling import profiler_from_config
+from simulation.road_network import RoadNetwork
+
+# Transitions and whole batches are logged at debug: kept in the ring buffer, written only with log_level debug
+log = EventLog('supervisor')
+
+# Robots are spawned and recharged here
+BASE = (0, 0)
 
 class RobotSM(StateMachine):
     wait_in_field = State()
@@ -26,6 +46,7 @@ class RobotSM(StateMachine):
     robot_deliver1 = wait_in_restaurant.to(travel_to_client, after='robot_deliver1')
     food_delivered = travel_to_client.to(wait_in_client, after='food_delivered')
     robot_deliver2 = wait_in_client.to(travel_to_client, after='robot_deliver2')
+    robot_pick3 = wait_in_client.to(travel_to_restaurant, after='robot_pick3')
     robot_empty = wait_in_client.to(wait_in_field, after='robot_empty')
 
     battery_dead1 = travel_to_restaurant.to(dead, after='battery_dead1')
@@ -33,7 +54,7 @@ class RobotSM(StateMachine):
     battery_dead3 = travel_to_base.to(dead, after='battery_dead3')
 
     def on_enter_state(self, target, event):
-        print(f"robot: entering {target} from {event}")
+        log.debug('robot state', state=target.name, event=event)
 
 class Robot:
     id = 0
@@ -44,7 +65,21 @@ class Robot:
         self.sm = RobotSM()
         Robot.id +=1
         self.battery_low = False
-        self.position = [0, 0]
+        self.battery = supervisor.battery_range  # range left once the robot reaches position
+        self._position = [0, 0]
+        self.orders = {}  # order_number -> Order assigned to this robot, kept up to date by the supervisor
+        self.restaurant = None  # restaurant the robot collects orders from on its current stop
+        self.queued = []  # orders whose delivery the simulation already has queued, in route order
+
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        self._position = position
+        if self in self.supervisor.available:
+            self.supervisor.available.move(self)
 
     def send(self, event):
         if event=='robot_pick' and self.sm.current_state.name=='Wait in field':
@@ -53,6 +88,9 @@ class Robot:
         if event=='robot_pick' and self.sm.current_state.name=='Wait in restaurant':
             event = 'robot_pick2'
 
+        if event=='robot_pick' and self.sm.current_state.name=='Wait in client':
+            event = 'robot_pick3'
+
         if event=='robot_deliver' and self.sm.current_state.name=='Wait in restaurant':
             event = 'robot_deliver1'
 
@@ -68,10 +106,13 @@ class Robot:
         if event=='battery_dead' and self.sm.current_state.name=='Travel to base':
             event = 'battery_dead3'
 
+        state = self.sm.current_state.name
         try:
             self.sm.send(event)
         except:
             pass
+        if self.sm.current_state.name != state:
+            self.supervisor.registry.move(self, state, self.sm.current_state.name)
 
     def feed_event(self, event):
         if 'robot_number' in event:
@@ -82,50 +123,111 @@ class Robot:
                     case 'battery_low':
                         self.battery_low = True
                     case 'robot_arrived':
-                        # orders = [order for order in self.supervisor.orders if order.robot.id==self.id]
-                        orders = []
-                        for order in self.supervisor.orders:
-                            if order.robot:
-                                if order.robot.id == self.id:
-                                    orders.append(order)
-
-                        #TODO consider all orders for this robot
-                        order = orders[0]
-                        if order.sm.current_state.name=='Wait for deliver':
-                            self.position = order.address
-                            self.supervisor.transmit({
-                                'id': 'robot_deliver',
-                                'robot_number': self.id,
-                                'food': order.food,
-                                'address': order.address,
-                                'order_number': order.id,
-                            })
+                        self.advance()
 
                 match self.sm.current_state.name:
                     case 'Wait in base':
                         self.battery_low = False
+                        self.battery = self.supervisor.battery_range
                         self.position = [0, 0]
                     case 'Wait in field':
                         if self.battery_low:
-                            self.position = [0, 0]
-                            self.supervisor.transmit({
-                                'id': 'robot_return',
-                                'robot_number': self.id,
-                            })
+                            self.return_to_base()
 
         else:
-            match event['id']:
-                case 'food_delivered':
-                    orders = []
-                    for order in self.supervisor.orders:
-                        if order.robot:
-                            if order.robot.id == self.id:
-                                orders.append(order)
+            if event['order_number'] in self.orders:
+                match event['id']:
+                    case 'food_delivered':
+                        self.send('food_delivered')
+                        self.advance()
+                    case 'food_ready' | 'food_picked':
+                        self.advance()
+
+    def return_to_base(self):
+        self.position = [0, 0]
+        self.supervisor.transmit({
+            'id': 'robot_return',
+            'robot_number': self.id,
+        })
+
+    def move_to(self, point):
+        """Make point the robot's next stop, the road there is paid from its battery."""
+        self.battery -= self.supervisor.leg(self.position, point)
+        self.position = point
+
+    def range_needed(self, orders):
+        """Road distance to finish these orders and get back to the base, inf if they do not fit."""
+        route = self.plan(orders)
+        if route is None:
+            return math.inf
+        end = route[-1].point if route else self.position
+        return route_length(self.position, route, self.supervisor.leg) + self.supervisor.leg(end, BASE)
+
+    def load(self):
+        """Food size of all orders the robot carries or is on its way to collect."""
+        return sum(order.food['size'] for order in self.orders.values() if not order.is_finished())
+
+    def advance(self):
+        """
+        Send the robot on its next leg once it has nothing left to wait for.
+        The remaining stops are ordered by route_planner.plan_route: all
+        orders at one restaurant are collected on a single stop and every
+        order is picked up before it is delivered. Once only deliveries are
+        left they are sent together and the simulation drives through them
+        as queued waypoints.
+        """
+        state = self.sm.current_state.name
+        orders = [order for order in self.orders.values() if not order.is_finished()]
+        if not orders or state not in ('Wait in field', 'Travel to restaurant', 'Wait in restaurant', 'Wait in client'):
+            return
 
-                    # orders = [order for order in self.supervisor.orders if order.robot.id==self.id]
+        if state=='Wait in client' and self.queued:
+            # The simulation is already on its way to the next queued address
+            order = self.queued.pop(0)
+            self.move_to(order.address)
+            self.send('robot_deliver')
+            return
 
-                    if(len(orders)>0):
-                        self.send('food_delivered')
+        if state in ('Travel to restaurant', 'Wait in restaurant'):
+            # Orders that joined the trip at the current stop are collected on it,
+            # the simulation sends the robot back to the same spot to pick them up,
+            # which takes a step of battery once it is already there
+            joined = [order for order in orders if order.restaurant==self.restaurant and not order.pick_requested]
+            for order in joined:
+                order.request_pick()
+            if joined:
+                self.battery -= 1
+            if joined or state=='Travel to restaurant':
+                return
+
+            # A ready order is picked up by the waiting robot before the next leg reaches the simulation
+            if any(order.restaurant==self.restaurant and not order.is_ready() for order in orders):
+                return
+
+        route = self.plan(orders)
+        if not route:
+            return
+        if route[0].kind=='pickup':
+            self.restaurant = self.orders[route[0].jobs[0]].restaurant
+            self.move_to(self.restaurant)
+            for key in route[0].jobs:
+                self.orders[key].request_pick()
+        else:
+            self.restaurant = None
+            deliveries = route if all(stop.kind=='deliver' for stop in route) else route[:1]
+            deliveries = [self.orders[stop.jobs[0]] for stop in deliveries]
+            self.move_to(deliveries[0].address)
+            for order in deliveries:
+                order.request_delivery()
+            self.queued = deliveries[1:]
+
+    def plan(self, orders):
+        """Remaining stops of the trip, starting where the robot is."""
+        jobs = [Job(order.id, None if order.pick_requested else order.restaurant, order.address, order.food['size'])
+                for order in orders]
+        carried = sum(order.food['size'] for order in orders if order.pick_requested)
+        capacity = self.supervisor.backpack_capacity if self.supervisor.batching else None
+        return plan_route(self.position, jobs, self.supervisor.distances, capacity, carried)
 
 class OrderSM(StateMachine):
     initial = State(initial=True)
@@ -140,7 +242,7 @@ class OrderSM(StateMachine):
     food_delivered = wait_for_deliver.to(finished, after='food_delivered')
 
     def on_enter_state(self, target, event):
-        print(f'order: entering {target} from {event}')
+        log.debug('order state', state=target.name, event=event)
 
 class Order:
     def __init__(self, supervisor, id, food, restaurant, address):
@@ -151,6 +253,7 @@ class Order:
         self.restaurant = restaurant
         self.address = address
         self.robot = None
+        self.pick_requested = False
 
     def send(self, event):
         try:
@@ -174,26 +277,9 @@ class Order:
             case 'food_ready':
                 if event['order_number']==self.id:
                     self.send(event['id'])
-
-                if self.robot:
-                    if self.robot.sm.current_state.name=='Wait in restaurant':
-                        self.supervisor.transmit({
-                            'id': 'robot_deliver',
-                            'robot_number': self.robot.id,
-                            'food': self.food,
-                            'address': self.address,
-                            'order_number': self.id,
-                        })
             case 'food_picked':
                 if event['order_number']==self.id:
                     self.send(event['id'])
-                    self.supervisor.transmit({
-                        'id': 'robot_deliver',
-                        'robot_number': self.robot.id,
-                        'food': self.food,
-                        'address': self.address,
-                        'order_number': self.id,
-                    })
 
         match self.sm.current_state.name:
             case 'Initial':
@@ -204,45 +290,61 @@ class Order:
                     'restaurant': self.restaurant,
                 })
 
-                waiting_robots = [robot for robot in self.supervisor.robots if robot.sm.current_state.name=='Wait in field' or robot.sm.current_state.name=='Wait in base']
-
-                if len(waiting_robots)>0:
-                    field_robots = [robot for robot in self.supervisor.robots if robot.sm.current_state.name=='Wait in field']
-
-                    if len(field_robots)==0:
-                        self.supervisor.transmit({
-                            'id': 'robot_spawn',
-                        })
-                        field_robots = [robot for robot in self.supervisor.robots if robot.sm.current_state.name=='Wait in field']
-
-                    min_dist = 1000000
-                    for robot in field_robots:
-                        dist = np.abs(robot.position[0] - self.restaurant[0]) + np.abs(robot.position[1] - self.restaurant[1])
-                        if dist<min_dist:
-                            self.robot = robot
-                            min_dist = dist
-
-                    self.robot.position = self.restaurant
-                    self.supervisor.transmit({
-                        'id': 'robot_pick',
-                        'robot_number': self.robot.id,
-                        'order_number': self.id,
-                        'food': self.food,
-                        'restaurant': self.restaurant,
-                    })
+                # A robot is picked for it in Supervisor.dispatch, together with the rest of the batch.
+                # No robot could deliver an order beyond a full battery and make it back, it is left out
+                if self.supervisor.in_range([self]):
+                    self.supervisor.unassigned[self.id] = self
+                else:
+                    log.warning('order out of battery range, not dispatched', order=self.id,
+                                restaurant=self.restaurant, address=self.address)
+
+    def assign(self, robot):
+        """Add the order to the robot's trip, Robot.advance decides when it is collected."""
+        self.robot = robot
+        self.robot.orders[self.id] = self
+
+    def request_pick(self):
+        self.pick_requested = True
+        self.supervisor.transmit({
+            'id': 'robot_pick',
+            'robot_number': self.robot.id,
+            'order_number': self.id,
+            'food': self.food,
+            'restaurant': self.restaurant,
+        })
+
+    def request_delivery(self):
+        self.supervisor.transmit({
+            'id': 'robot_deliver',
+            'robot_number': self.robot.id,
+            'food': self.food,
+            'address': self.address,
+            'order_number': self.id,
+        })
+
+    def is_ready(self):
+        return self.sm.current_state.name in ('Wait for pick', 'Wait for deliver', 'Finished')
 
     def is_finished(self):
         return self.sm.current_state.name=='Finished'
 
 class Communication:
-    def __init__(self, host, port):
+    def __init__(self, host, port, wire_format='json', metrics=None):
         self.host = host
         self.port = port
+        self.wire_format = wire_format
+        # Batch sizes and bytes on the wire, in both directions
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.codec = DEFAULT_CODEC
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.setblocking(0)
         self.connected = False
+        self.peer_closed = False
+        self.frames_received = 0
+        self.decoder = FrameDecoder()
         self.attempt_connection()
+        self.handshake()
 
     def attempt_connection(self):
         attempt_count = 0
@@ -280,44 +382,189 @@ class Communication:
                 return False
         return False
 
+    def handshake(self):
+        """Offer our wire format to the simulation and switch to the one it picks."""
+        try:
+            send_all(self.socket, make_hello(self.wire_format))
+            reply = DEFAULT_CODEC.decode(read_frame_blocking(self.socket, self.decoder))
+            self.codec = CODECS[reply['codec']]
+            print(f"Using {self.codec.name} wire format.")
+        except (KeyError, ValueError, socket.error) as e:
+            print(f"Handshake failed: {e}")
+            sys.exit(1)
+
     def send_dict(self, data_):
         if not self.connected:
             print("No connection available to send data.")
             return
         try:
-            data_to_send = json.dumps(data_)
-            self.socket.sendall(data_to_send.encode('utf-8'))
+            message = encode_message(data_, self.codec)
+            send_all(self.socket, message)
+            self.metrics.observe('bytes_sent', len(message))
+            self.metrics.observe('batch_sent', len(data_))
         except (TypeError, ValueError, socket.error) as e:
             print("Error sending data:", str(e))
 
-    def receive_dict(self):
+    def receive_dict(self, timeout=0.1):
         try:
-            ready_to_read, _, _ = select.select([self.socket], [], [], 0.1)
+            ready_to_read, _, _ = select.select([self.socket], [], [], timeout)
             if ready_to_read:
-                data = self.socket.recv(1024).decode('utf-8')
+                data, self.peer_closed = recv_available(self.socket)
                 if data:
-                    return json.loads(data)
-            return {}
-        except (BlockingIOError, socket.timeout):
-            return {}
-        except (json.JSONDecodeError, socket.error) as e:
+                    self.metrics.observe('bytes_received', len(data))
+                    frames = self.decoder.feed(data)
+                    self.frames_received = len(frames)
+                    events = decode_messages(frames, self.codec)
+                    if frames:
+                        self.metrics.observe('batch_received', len(events))
+                    return events
+            return []
+        except socket.timeout:
+            return []
+        except FramingError as e:
             print("Error receiving data:", e)
-            return {}
+            self.lose_connection()
+            return []
+        except (ValueError, socket.error) as e:
+            print("Error receiving data:", e)
+            return []
+
+    def lose_connection(self):
+        """Stop reading from a stream that cannot be decoded any more, as if the simulation had closed it."""
+        self.peer_closed = True
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
     def close(self):
         self.socket.close()
 
+class ReactionLatency:
+    """
+    Time from reading a batch off the socket until the decisions it caused
+    are flushed back, recorded once for every event of the batch.
+    """
+    def __init__(self, report_interval=5.0):
+        self.report_interval = report_interval
+        self.samples = []
+        self.last_report = time.monotonic()
+        # Totals and a histogram (microseconds, one entry per event) over the whole run, for summary
+        self.events = 0
+        self.busy = 0.0
+        self.histogram = Histogram()
+
+    def record(self, latency, event_count):
+        self.samples.extend([latency] * event_count)
+        self.events += event_count
+        self.busy += latency
+        if event_count:
+            self.histogram.add(latency * 1e6, event_count)
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        if not self.samples:
+            return
+        samples = np.array(self.samples) * 1000.0
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        print(f'reaction latency over {len(samples)} events [ms]: '
+              f'mean {samples.mean():.3f} | p50 {p50:.3f} | p95 {p95:.3f} | p99 {p99:.3f} | max {samples.max():.3f}')
+        self.samples = []
+
+    def summary(self):
+        """
+        Events handled per second of handling and latency percentiles over the
+        whole run. The percentiles are estimates, interpolated inside the
+        power-of-two buckets of a metrics.Histogram.
+        """
+        if not self.events:
+            return
+        p50, p95, p99 = (self.histogram.percentile(q) / 1000.0 for q in (50, 95, 99))
+        print(f'handled {self.events} events in {self.busy:.3f} s | '
+              f'{self.events / self.busy if self.busy else 0.0:.0f} events/s | '
+              f'latency [ms] p50 {p50:.3f} | p95 {p95:.3f} | p99 {p99:.3f}')
+
+class RobotRegistry:
+    """
+    Robots grouped by the name of their current state. Robot.send moves a
+    robot between groups on every transition, so asking how many robots
+    wait in the field or which one to take out of the base costs O(1).
+    Robots in indexed_state are also kept in spatial_index.
+    """
+    def __init__(self, spatial_index=None, indexed_state=None):
+        # OrderedDict: taking the first robot stays O(1) after many removals from the front
+        self.by_state = defaultdict(OrderedDict)
+        self.spatial_index = spatial_index
+        self.indexed_state = indexed_state
+
+    def add(self, robot):
+        state = robot.sm.current_state.name
+        self.by_state[state][robot.id] = robot
+        if self.spatial_index is not None and state == self.indexed_state:
+            self.spatial_index.add(robot)
+
+    def move(self, robot, old_state, new_state):
+        self.by_state[old_state].pop(robot.id, None)
+        self.by_state[new_state][robot.id] = robot
+        if self.spatial_index is not None:
+            if old_state == self.indexed_state:
+                self.spatial_index.remove(robot)
+            if new_state == self.indexed_state:
+                self.spatial_index.add(robot)
+
+    def count(self, state):
+        return len(self.by_state[state])
+
+    def robots(self, state):
+        return self.by_state[state].values()
+
+    def first(self, state):
+        """Robot that has been in the state the longest, None if there is none."""
+        bucket = self.by_state[state]
+        return bucket[next(iter(bucket))] if bucket else None
+
 class Supervisor:
-    def __init__(self, host, port):
-        with open("simulation/config.json", 'r', encoding='utf-8') as f:
-            config = json.load(f)
+    # Events that name only an order but also concern the robot carrying it
+    ORDER_ROBOT_EVENTS = {'food_ready', 'food_picked', 'food_delivered'}
+
+    def __init__(self, host, port, communication=None, config=None):
+        if config is None:
+            with open("simulation/config.json", 'r', encoding='utf-8') as f:
+                config = json.load(f)
 
+        self.config = config
+        log.configure_from(config)
         max_robots = config["max_robots"]
 
-        self.communication = Communication(host, port)
+        # Handling time by event id, dispatch time and orders waiting, see simulation.metrics
+        self.metrics = metrics_from_config(config, 'metrics_supervisor')
+        if communication is None:
+            communication = Communication(host, port, config.get("wire_format", "json"), self.metrics)
+        self.communication = communication
         self.to_send = []
+        # Robots waiting in the field, by position, for picking the nearest one to a restaurant
+        self.available = SpatialIndex(cell_size=3)
+        self.registry = RobotRegistry(self.available, 'Wait in field')
+        # Range of a full battery, one unit per road cell, the simulation is told at spawn
+        self.battery_range = config.get('battery_range', 100)
         self.robots = [Robot(self) for _ in range(max_robots)]
-        self.orders = []
+        self.robots_by_id = {robot.id: robot for robot in self.robots}
+        for robot in self.robots:
+            self.registry.add(robot)
+        self.orders = {}  # order_number -> Order, in the order they came in
+        self.unassigned = OrderedDict()  # order_number -> Order still waiting for a robot
+        self.dispatch_mode = config.get('dispatch', 'greedy')
+        # With batching a robot takes several orders from one restaurant, or
+        # from restaurants at most batch_radius apart, as long as they fit its backpack
+        self.batching = config.get('batching', False)
+        self.batch_radius = config.get('batch_radius', 0)
+        self.backpack_capacity = config.get('backpack_capacity', 1)
+        # Road distances, the same model the simulation moves robots with
+        self.network = RoadNetwork(config["city_size"], config.get("road_spacing", 3))
+        self.distances = DistanceTable(self.network.distance)
 
     def transmit(self, controllable_event):
         #print(f'tx {controllable_event}')
@@ -325,51 +572,264 @@ class Supervisor:
         self.to_send.append(controllable_event)
 
         if controllable_event['id']=='robot_spawn':
-            robots_in_the_base = [robot for robot in self.robots if robot.sm.current_state.name=='Wait in base']
-
-            robot = robots_in_the_base[0]
+            # Robots that never left the base come first, in id order, like the simulation spawns them
+            robot = self.registry.first('Wait in base')
             robot.send('robot_spawn')
         else:
             self.receive(controllable_event)
 
-    def flush(self):
-        if len(self.to_send)>0:
-            print(self.to_send)
+    def flush(self, acknowledge=False):
+        # An empty batch still tells a headless simulation that its tick was handled
+        if len(self.to_send)>0 or acknowledge:
+            if self.to_send:
+                log.debug('tx', events=self.to_send)
             self.communication.send_dict(self.to_send)
             self.to_send = []
 
     def receive(self, event):
         if event['id']=='new_order':
-            self.orders.append(Order(self,
+            self.orders[event['order_number']] = Order(self,
                 event['order_number'],
                 event['food'],
                 event['restaurant'],
                 event['address']
-            ))
+            )
 
-        for order in self.orders:
+        if event.get('order_number') in self.orders:
+            fed_orders = [self.orders[event['order_number']]]
+        else:
+            fed_orders = []
+        for order in fed_orders:
             order.feed_event(event)
 
-        for robot in self.robots:
-            robot.feed_event(event)
+        if 'robot_number' in event:
+            if event['robot_number'] in self.robots_by_id:
+                self.robots_by_id[event['robot_number']].feed_event(event)
+        elif event['id'] in self.ORDER_ROBOT_EVENTS and event.get('order_number') in self.orders:
+            robot = self.orders[event['order_number']].robot
+            if robot:
+                robot.feed_event(event)
+
+        for order in fed_orders:
+            if order.is_finished():
+                self.orders.pop(order.id, None)
+                if order.robot:
+                    order.robot.orders.pop(order.id, None)
+
+    def receive_batch(self, events):
+        metrics = self.metrics
+        for event in events:
+            start = time.perf_counter()
+            self.receive(event)
+            metrics.time(event['id'], time.perf_counter() - start)
+        metrics.observe('unassigned_orders', len(self.unassigned))
+        start = time.perf_counter()
+        self.dispatch()
+        metrics.time('dispatch', time.perf_counter() - start)
+
+    def dispatch(self):
+        """
+        Match all orders still waiting for a robot with the robots waiting in
+        the field, once per received batch. Robots are spawned from the base
+        if there are fewer of them than orders. Orders that get no robot stay
+        in the queue for the next batch.
+
+        With batching, orders first join robots still collecting at a
+        restaurant nearby, the rest are bundled into trips before matching.
+        """
+        if not self.unassigned:
+            return
+        orders = list(self.unassigned.values())
+        if self.batching:
+            orders = self.join_trips(orders)
+            trips = self.bundle(orders)
+        else:
+            trips = [[order] for order in orders]
+        if not trips:
+            return
 
-        self.orders = [order for order in self.orders if not order.is_finished()]
+        missing = len(trips) - self.registry.count('Wait in field')
+        for _ in range(min(missing, self.registry.count('Wait in base'))):
+            self.transmit({
+                'id': 'robot_spawn',
+                'battery_range': self.battery_range,
+            })
+        if not len(self.available):
+            return
+
+        # Only each trip's len(trips) nearest robots are candidates. The grid
+        # index ranks them by Manhattan distance: with that cost the set would
+        # always hold an optimal matching, but the cost here is road distance,
+        # so a robot ranked further away can occasionally be cheaper and the
+        # result is a close approximation, not a guaranteed optimum.
+        candidates = {}
+        for trip in trips:
+            for robot in self.available.nearest(trip[0].restaurant, len(trips)):
+                candidates[robot.id] = robot
+        robots = [candidates[robot_id] for robot_id in sorted(candidates)]
+
+        cost = self.network.cost_matrix([trip[0].restaurant for trip in trips], [robot.position for robot in robots])
+        # A robot only gets a trip it can finish and still drive back to the base on
+        # what is left of its battery, a robot that cannot afford any of them goes to
+        # recharge instead of dying on the way with the food
+        need = np.maximum(cost, 1) + np.array([self.trip_range(trip) for trip in trips])[:, None]
+        affordable = need <= np.array([robot.battery for robot in robots])
+        cost[~affordable] = np.inf
+        for robot, column in zip(robots, affordable.T):
+            if not column.any() and robot.battery < self.battery_range:
+                robot.return_to_base()
+        # Trips no robot has a road to (or the range for) wait in the queue, they would only take a robot from another trip
+        reachable = ~np.isinf(cost).all(axis=1)
+        if not reachable.any():
+            return
+        trips = [trip for trip, keep in zip(trips, reachable) if keep]
+        cost = cost[reachable]
+        # The solvers need finite costs: a pair with no road between them costs more
+        # than all real pairs together, so it is only picked when nothing else is left,
+        # and is then dropped below
+        unreachable = np.isinf(cost)
+        cost[unreachable] = cost[~unreachable].sum() + 1
+        columns = SOLVERS[self.dispatch_mode](cost)
+        for row, (trip, column) in enumerate(zip(trips, columns)):
+            if column >= 0 and not unreachable[row, column]:
+                for order in trip:
+                    del self.unassigned[order.id]
+                    order.assign(robots[column])
+                robots[column].advance()
+
+    def join_trips(self, orders):
+        """
+        Add orders to robots that are still collecting at a restaurant within
+        batch_radius and have room left in the backpack. Returns the orders
+        that found no such robot.
+        """
+        collecting = defaultdict(list)  # restaurant -> [[robot, free space]]
+        for state in ('Travel to restaurant', 'Wait in restaurant'):
+            for robot in self.registry.robots(state):
+                if robot.restaurant is not None and not robot.battery_low:
+                    collecting[tuple(robot.restaurant)].append([robot, self.backpack_capacity - robot.load()])
+
+        left = []
+        for order in orders:
+            best = None
+            for restaurant, robots in collecting.items():
+                distance = self.network.distance(restaurant, order.restaurant)
+                if distance > self.batch_radius:
+                    continue
+                for entry in robots:
+                    if entry[1] >= order.food['size'] and (best is None or (distance, entry[0].id) < best[0]):
+                        robot = entry[0]
+                        trip = [other for other in robot.orders.values() if not other.is_finished()] + [order]
+                        # One more step for going back to the same spot, see Robot.advance
+                        if robot.range_needed(trip) + 1 <= robot.battery:
+                            best = ((distance, robot.id), entry)
+            if best is None:
+                left.append(order)
+                continue
+            robot = best[1][0]
+            best[1][1] -= order.food['size']
+            del self.unassigned[order.id]
+            order.assign(robot)
+            robot.advance()
+        return left
+
+    def leg(self, a, b):
+        """Battery a robot spends driving from a to b, a step even when both are the same cell."""
+        return max(self.distances(a, b), 1)
+
+    def trip_range(self, trip):
+        """
+        Road distance a robot needs for a trip once it reaches the first
+        restaurant: the planned route plus the longest way back to the base
+        from any of its addresses, as the route may end at either of them.
+        """
+        jobs = [Job(order.id, order.restaurant, order.address, order.food['size']) for order in trip]
+        capacity = self.backpack_capacity if self.batching else None
+        route = plan_route(trip[0].restaurant, jobs, self.distances, capacity)
+        if route is None:
+            return math.inf
+        back = max(self.leg(order.address, BASE) for order in trip)
+        return route_length(trip[0].restaurant, route, self.leg) + back
+
+    def in_range(self, trip):
+        """Whether a robot leaving the base with a full battery can do the trip."""
+        return self.leg(BASE, trip[0].restaurant) + self.trip_range(trip) <= self.battery_range
+
+    def bundle(self, orders):
+        """
+        Group orders into trips from restaurants within batch_radius that fit
+        one backpack and one full battery.
+        """
+        trips = []  # [orders, food size]
+        for order in orders:
+            size = order.food['size']
+            for trip in trips:
+                if (trip[1] + size <= self.backpack_capacity
+                        and self.network.distance(trip[0][0].restaurant, order.restaurant) <= self.batch_radius
+                        and self.in_range(trip[0] + [order])):
+                    trip[0].append(order)
+                    trip[1] += size
+                    break
+            else:
+                trips.append([[order], size])
+        return [trip for trip, _ in trips]
+
+    def run(self):
+        """
+        Wait on the socket and react as soon as data arrives: every received
+        batch is handled and the resulting decisions are flushed right away.
+        """
+        latency = ReactionLatency()
+        # Off unless config "profile" or ROBOGLOVO_PROFILE is set, see simulation.profiling.Profiler
+        profiler = profiler_from_config(self.config, 'supervisor', {
+            'receive': [Supervisor.receive],
+            'dispatch': [Supervisor.dispatch],
+            'route planner': [plan_route],
+            'json codec': [JsonCodec.encode, JsonCodec.decode],
+            'binary codec': [BinaryCodec.encode, BinaryCodec.decode],
+            'statemachine': statemachine,
+        })
+        selector = selectors.DefaultSelector()
+        selector.register(self.communication.socket, selectors.EVENT_READ)
+        try:
+            while not self.communication.peer_closed:
+                if selector.select(timeout=latency.report_interval):
+                    received_at = time.perf_counter()
+                    self.communication.frames_received = 0
+                    received_data = self.communication.receive_dict(timeout=0)
+                    if received_data:
+                        log.debug('rx', events=received_data)
+                    self.receive_batch(received_data)
+                    self.flush(acknowledge=self.communication.frames_received > 0)
+                    latency.record(time.perf_counter() - received_at, len(received_data))
+                latency.report()
+                self.metrics.maybe_write()
+                if profiler:
+                    profiler.step()
+            print("Simulation closed the connection.")
+        finally:
+            if profiler:
+                profiler.stop()
+            latency.report(force=True)
+            latency.summary()
+            self.metrics.write()
+            selector.close()
 
 if __name__ == "__main__":
-    supervisor = Supervisor('localhost', int(sys.argv[1]))
+    # python supervisor.py PORT [CONFIG], CONFIG being the file the simulation was started with
+    config = None
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    supervisor = Supervisor('localhost', int(sys.argv[1]), config=config)
+    log.install_signal()
     try:
-        while True:
-            received_data = supervisor.communication.receive_dict()
-            if received_data:
-                print(f'rx {received_data}')
-                for msg in received_data:
-                    supervisor.receive(msg)
-            supervisor.flush()
-            time.sleep(0.5)
+        supervisor.run()
     except KeyboardInterrupt:
         print("Shutting down Supervisor.")
     finally:
         supervisor.communication.close()
+        log.close()
 
 '''
 supervisor = Supervisor('localhost', 12345)